@@ -1,8 +1,18 @@
+from __future__ import print_function
 # ============================================================================
-# Numerical and plotting libraries
+# Numerical libraries.  The plotting libraries are imported by show_plot, so
+# batch runs with --headless never load matplotlib.
+import functools
+import sys
 import numpy as np
-import pylab as pl
-from matplotlib.widgets import Slider, Button
+import batch
+import shooting
+import matching
+import eigensolver
+import potentials
+import observables
+import cache
+import interactive
 # =============================================================================
 #
 # Simulation Constants. Be sure to include decimal points on appropriate
@@ -13,22 +23,55 @@ total_x_length = 10.0  # total length on x axis to calculate for
 # Note: for calculating the negative x limit in terms of length units multiply dx * negative_x_limit
 dx = total_x_length / (abs(negative_x_limit) + abs(positive_x_limit))  # dx is total length by total divisions
 xaxis = range(negative_x_limit, positive_x_limit + 1, 1)
+potential_slope = 2.0  # potential is potential_slope * |x|
+particle_mass = 0.5  # mass in units where hbar = 1, so d2psi by du2 = (potential - energy) * psi
 # Variables for particle in a box potential
 # Often, the elements of an array are originally unknown, but its size is known.
 # Hence, NumPy offers several functions to create arrays with initial placeholder content.
 # These minimize the necessity of growing arrays, an expensive operation.
 psi_u_array = np.zeros(len(xaxis))
 energy_eigen_values = []
+energy_eigen_parities = []  # 0 for the even and 1 for the odd eigen states
+energy_eigen_vectors = np.zeros((0, len(xaxis)))
 plot = None
 s_energy = None
 axes = None
 displayed_energy_eigen_index = 0
+pl = None
+eigen_cache = None  # cache.EigenCache used by calculate_eigen_psi_cached
+psi_cache = None  # interactive.PsiCache of the wave functions shown by the slider
+update_callback = None
 # =============================================================================
 
 
+def set_constants(divisions=None, length=None, slope=None):
+    "changes the simulation constants and resizes the arrays that depend on them"
+    "divisions is the number of divisions on each side of 0"
+    global negative_x_limit, positive_x_limit, total_x_length, potential_slope, dx, xaxis
+    global psi_u_array, energy_eigen_vectors
+    if divisions is not None:
+        negative_x_limit = -divisions
+        positive_x_limit = divisions
+    if length is not None:
+        total_x_length = length
+    if slope is not None:
+        potential_slope = slope
+    dx = total_x_length / (abs(negative_x_limit) + abs(positive_x_limit))
+    xaxis = range(negative_x_limit, positive_x_limit + 1, 1)
+    psi_u_array = np.zeros(len(xaxis))
+    energy_eigen_vectors = np.zeros((0, len(xaxis)))
+
+
 def get_symmertric_potential(position):
     "returns potential at a position"
-    return abs(position) * 2
+    return potentials.symmetric(position, potential_slope)
+
+
+def get_potential_array():
+    "returns potential at every division of xaxis as a numpy array"
+    "the array is computed once and shared, so it must not be modified"
+    return potentials.potential_array('symmetric', dx, len(xaxis), first_division=negative_x_limit,
+                                      slope=potential_slope)
 
 
 def get_position(current_division):
@@ -46,8 +89,15 @@ def calculate_psi(assumed_energy, isEvenSolution):
         psi_u = 0
         psi_u_ddu = 1
     current_division = 0
+    potential_list = get_potential_array().tolist()
     positive_xaxis = range(abs(negative_x_limit), len(xaxis), 1)
     for index in positive_xaxis:
+        if abs(psi_u) >= 20:
+            # if psi is greater than 20 then it is most likely not going to diverge, so stop
+            # lengthy calculations and hold psi at this value over the rest of both halves
+            psi_u_array[index:] = psi_u
+            psi_u_array[:len(xaxis) - index] = psi_u if isEvenSolution else -psi_u
+            break
         psi_u_array[index] = psi_u  # storing psi of current division
         if xaxis[index] != 0:
             if isEvenSolution:
@@ -55,42 +105,236 @@ def calculate_psi(assumed_energy, isEvenSolution):
             else:
                 psi_u_array[len(xaxis) - index - 1] = - psi_u
         current_division = xaxis[index]
-        if (abs(psi_u) < 20):  # if psi is greater than 20 then it is most likely not going to diverge, so stop lengthy calculations
-            potential = get_symmertric_potential(get_position(current_division))  # - 2*r*R_dr
-            psi_u_d2du2 = (potential - assumed_energy) * psi_u  # psi by du2 at current division
-            psi_u_ddu = psi_u_ddu + psi_u_d2du2 * dx  # psi by du at next division
-            psi_u = psi_u + psi_u_ddu * dx  # psi at next division Using backward eular method
+        potential = potential_list[index]  # - 2*r*R_dr
+        psi_u_d2du2 = (potential - assumed_energy) * psi_u  # psi by du2 at current division
+        psi_u_ddu = psi_u_ddu + psi_u_d2du2 * dx  # psi by du at next division
+        psi_u = psi_u + psi_u_ddu * dx  # psi at next division Using backward eular method
+
+
+def is_even_solution(assumed_energy):
+    "returns True if the state shown at assumed_energy is even, that is if the first"
+    "eigen value at or above it is an even state, and False otherwise"
+    for index in range(len(energy_eigen_values)):
+        if assumed_energy <= energy_eigen_values[index]:
+            return energy_eigen_parities[index] == 0
+    return False
+
+
+def get_parities(eigen_states):
+    "returns 0 for the even and 1 for the odd wave functions, from their symmetry about 0"
+    return (np.sum(eigen_states * eigen_states[:, ::-1], axis=1) < 0).astype(int)
+
+
+def mirror(half, is_even):
+    "returns the wave functions given for x >= 0 continued to x < 0 by their parity"
+    psi = np.zeros((len(half), len(xaxis)))
+    psi[:, abs(negative_x_limit):] = half
+    psi[:, :abs(negative_x_limit)] = np.where(is_even, 1, -1)[:, None] * half[:, :0:-1]
+    return psi
+
+
+def get_stored_eigen_state(assumed_energy):
+    "returns the stored wave function of the eigen value assumed_energy, or None"
+    if len(energy_eigen_vectors) != len(energy_eigen_values):
+        return None
+    if assumed_energy not in energy_eigen_values:
+        return None
+    return energy_eigen_vectors[energy_eigen_values.index(assumed_energy)]
+
+
+def compute_psi(assumed_energy):
+    "returns a copy of the wave function calculate_psi finds for assumed_energy"
+    psi = get_stored_eigen_state(assumed_energy)
+    if psi is not None:
+        return psi.copy()
+    return get_psi_batch([assumed_energy], get_potential_array()[abs(negative_x_limit):])[0]
+
+
+def get_psi_batch(energies, potential):
+    "returns the wave functions of every energy for the potential on the half grid x >= 0,"
+    "without touching psi_u_array or the potential cache, so it can run on another thread"
+    is_even = np.array([is_even_solution(energy) for energy in energies], dtype=bool)
+    psi = np.zeros((len(energies), len(xaxis)))
+    for parity, psi_0, dpsi_0 in ((is_even, 1, 0), (~is_even, 0, 1)):
+        if not parity.any():
+            continue
+        _, _, half = shooting.shoot(np.asarray(energies)[parity], potential, dx, psi_0, dpsi_0,
+                                    cutoff=20, store_psi=True)
+        psi[parity] = mirror(half, is_even[parity])
+    for index, energy in enumerate(energies):
+        # eigen states are the ones the eigen value search stored
+        stored = get_stored_eigen_state(energy)
+        if stored is not None:
+            psi[index] = stored
+    return psi
+
 
+def calculate_expectation(assumed_energy):
+    "prints normalization constant and expectation values of psi_u_array"
+    values = observables.expectation_values(psi_u_array, dx, get_position(np.array(xaxis)),
+                                            get_potential_array(), m=particle_mass)
+    print("normalization constant", values['norm'])
+    print("Expectation of x2", values['x2'], "and p2", values['p2'])
+    print("Expectation of H", values['H'], "for energy", assumed_energy)
+    print("Uncertainty product", values['uncertainty'])
 
-def calculate_eigen_psi(lower_limit, upper_limit, interval_size):
-    global energy_eigen_values
+
+def get_eigen_states():
+    "returns the wave functions of every eigen state in energy_eigen_values"
+    if len(energy_eigen_vectors) == len(energy_eigen_values):
+        return energy_eigen_vectors
+    eigen_states = np.zeros((len(energy_eigen_values), len(xaxis)))
+    for index in range(len(energy_eigen_values)):
+        calculate_psi(energy_eigen_values[index], energy_eigen_parities[index] == 0)
+        eigen_states[index] = psi_u_array
+    return eigen_states
+
+
+def save_results(path, args):
+    "writes eigen values, eigen states and their expectation values to an npz file"
+    eigen_states = get_eigen_states()
+    position = get_position(np.array(xaxis))
+    values = observables.expectation_values(eigen_states, dx, position, get_potential_array(),
+                                            m=particle_mass)
+    arrays = dict(('expectation_' + name, value) for name, value in values.items())
+    batch.save_results(path, args, eigen_values=np.array(energy_eigen_values),
+                       eigen_states=eigen_states, position=position,
+                       potential=get_potential_array(), **arrays)
+
+
+def calculate_eigen_psi(lower_limit, upper_limit, interval_size, method='loop', tolerance=1e-6,
+                        integrator='euler', workers=None):
+    "scans energies from lower_limit to upper_limit in steps of interval_size"
+    "method is 'loop' to accept the energies where psi ends near zero,"
+    "'bracket' to use interval_size as a coarse grid for counting nodes and"
+    "refine each even and odd eigenvalue to tolerance, 'matching' to find"
+    "the levels of both parities from one outward and inward sweep, or"
+    "'tridiagonal' to diagonalize the grid hamiltonian in one call"
+    "'parallel' is 'bracket' with the scans shared among workers processes"
+    "integrator is 'euler', 'numerov' or 'rk4' for the bracket and parallel methods"
+    global energy_eigen_values, energy_eigen_vectors
     if (lower_limit >= upper_limit or upper_limit - lower_limit <= interval_size):
         return False
+    if method == 'tridiagonal':
+        eigen_values, energy_eigen_vectors = eigensolver.solve(
+            get_potential_array(), dx, lower_limit=lower_limit, upper_limit=upper_limit)
+        energy_eigen_values.extend(eigen_values.tolist())
+        energy_eigen_parities.extend(get_parities(energy_eigen_vectors))
+        if len(eigen_values) != 0:
+            psi_u_array[:] = energy_eigen_vectors[0]
+        print("eigen values", energy_eigen_values)
+        return
+    if method == 'matching':
+        energies = np.append(np.arange(lower_limit, upper_limit, interval_size), upper_limit)
+        potential = get_potential_array()[abs(negative_x_limit):]
+        eigen_values, parities = matching.find_eigenvalues(energies, potential, dx,
+                                                           tolerance=tolerance)
+        # the states come from the same recurrence and start as the eigen values,
+        # which calculate_psi does not share
+        energy_eigen_vectors = mirror(matching.eigen_states(eigen_values, parities, potential, dx),
+                                      parities == 0)
+        energy_eigen_values.extend(eigen_values.tolist())
+        energy_eigen_parities.extend(parities)
+        if len(eigen_values) != 0:
+            psi_u_array[:] = energy_eigen_vectors[0]
+        print("eigen values", energy_eigen_values)
+        return
+    if method in ('bracket', 'parallel'):
+        energies = np.arange(lower_limit, upper_limit, interval_size)
+        energies = np.append(energies, upper_limit)
+        potential = get_potential_array()[abs(negative_x_limit):]
+        options = dict(cutoff=20, tolerance=tolerance, integrator=integrator)
+        if method == 'parallel':
+            import parallel  # needs python 3.7 or later
+            find_eigenvalues = parallel.find_eigenvalues
+            options['workers'] = workers
+        else:
+            find_eigenvalues = shooting.find_eigenvalues
+        even_values = find_eigenvalues(energies, potential, dx, 1, 0, **options)
+        odd_values = find_eigenvalues(energies, potential, dx, 0, 1, **options)
+        eigen_values = np.append(even_values, odd_values)
+        order = np.argsort(eigen_values)
+        energy_eigen_values.extend(eigen_values[order].tolist())
+        energy_eigen_parities.extend(np.repeat([0, 1], [len(even_values), len(odd_values)])[order])
+        print("eigen values", energy_eigen_values)
+        return
     iteration_size = (upper_limit - lower_limit) / interval_size
     index = 0
     isEvenSolution = True
     while index < iteration_size:
         assumed_energy = lower_limit + index * interval_size
-        print assumed_energy, isEvenSolution
+        print(assumed_energy, isEvenSolution)
         calculate_psi(assumed_energy, isEvenSolution)
         if (round(psi_u_array[len(psi_u_array) - 1], 1) == 0):
             energy_eigen_values.append(assumed_energy)
+            energy_eigen_parities.append(0 if isEvenSolution else 1)
             if isEvenSolution:
                 isEvenSolution = False
             else:
                 isEvenSolution = True
         index += 1
-    print "eigen values", energy_eigen_values
+    print("eigen values", energy_eigen_values)
+
+
+def get_cache_key(lower_limit, upper_limit, interval_size, method, tolerance, integrator):
+    "returns the key of an eigen search in the eigen cache"
+    if method == 'parallel':
+        method = 'bracket'  # the same search with the scans shared among processes
+    if method in ('tridiagonal', 'matching'):
+        integrator = None  # not used by these solvers
+    if method == 'tridiagonal':
+        interval_size = tolerance = None
+    return cache.cache_key(potential='symmetric', potential_array=get_potential_array(),
+                           slope=potential_slope, length=total_x_length,
+                           negative_x_limit=negative_x_limit, positive_x_limit=positive_x_limit,
+                           mass=particle_mass, method=method, lower=lower_limit,
+                           upper=upper_limit, interval=interval_size, tolerance=tolerance,
+                           integrator=integrator)
+
+
+def calculate_eigen_psi_cached(lower_limit, upper_limit, interval_size, method='loop',
+                               tolerance=1e-6, integrator='euler', workers=None):
+    "calculate_eigen_psi through eigen_cache: a search already run with the same"
+    "constants and settings is loaded from disk, and a new one is stored there"
+    global energy_eigen_vectors
+    key = get_cache_key(lower_limit, upper_limit, interval_size, method, tolerance, integrator)
+    first = len(energy_eigen_values)
+    cached = eigen_cache.load(key)
+    if cached is None:
+        if calculate_eigen_psi(lower_limit, upper_limit, interval_size, method, tolerance,
+                               integrator, workers) is False:
+            return False
+        eigen_states = get_eigen_states()
+        if first == 0:
+            energy_eigen_vectors = eigen_states
+        eigen_cache.store(key, energy_eigen_values[first:], eigen_states[first:])
+        return
+    eigen_values, eigen_vectors = cached
+    energy_eigen_values.extend(eigen_values.tolist())
+    energy_eigen_parities.extend(get_parities(eigen_vectors))
+    if first == 0:
+        energy_eigen_vectors = eigen_vectors
+    if len(eigen_values) != 0:
+        psi_u_array[:] = eigen_vectors[0]
+    print("eigen values (cached)", energy_eigen_values)
 
 
 def show_plot():
-    global s_energy, plot, axes
+    global s_energy, plot, axes, pl, psi_cache, update_callback
+    import pylab as pl
+    from matplotlib.widgets import Slider, Button
+    # wave functions of the slider, with the eigen states computed up front
+    # so Previous, Next and Reset never wait
+    # the prefetch thread gets its own reference to the potential, as the
+    # potential cache behind get_potential_array is not thread safe
+    potential = get_potential_array()[abs(negative_x_limit):]
+    psi_cache = interactive.PsiCache(compute_psi, resolution=0.01,
+                                     compute_batch=functools.partial(get_psi_batch,
+                                                                     potential=potential))
+    psi_cache.fill(energy_eigen_values, exact=True)
     plot, = pl.plot(xaxis, psi_u_array, '-')
     pl.plot(xaxis, np.zeros(len(xaxis)), '-')
-    potential = []
-    for current_division in range(0, len(xaxis)):
-        potential.append(get_symmertric_potential(get_position(xaxis[current_division])))
-    pl.plot(xaxis, potential, '-')
+    pl.plot(xaxis, get_potential_array(), '-')
     # reposition plot for adding space for sliders
     pl.subplots_adjust(bottom=0.25)
     # axis labels and title
@@ -99,16 +343,17 @@ def show_plot():
     pl.title('Potential type: particle in a box')
     # marking in plot
     pl.grid(True)
-    x_scale = len(xaxis) / 10
-    y_scale = abs(max(psi_u_array) - min(psi_u_array)) / 4
-    pl.xticks(np.arange(min(xaxis), max(xaxis), x_scale))
-    pl.yticks(np.arange(min(psi_u_array), max(psi_u_array), min(y_scale, 1)))
+    x_scale = len(xaxis) // 10
+    pl.xticks(np.arange(xaxis[0], xaxis[-1], x_scale))
+    pl.yticks(interactive.psi_ticks(psi_u_array))
     axes = pl.gca()
     # show slider for E
-    ax_energy = pl.axes([0.25, 0.1, 0.65, 0.03], axisbg='lightgoldenrodyellow')
+    ax_energy = pl.axes([0.25, 0.1, 0.65, 0.03], facecolor='lightgoldenrodyellow')
     default_energy_value = 0.0e0
     s_energy = Slider(ax_energy, 'Energy', 0.0, 10.0, valinit=default_energy_value)
-    s_energy.on_changed(updateOnClick)
+    # a drag sends many events; only the latest one is computed and drawn
+    update_callback = interactive.CoalescedCallback(axes.figure.canvas, updateOnClick)
+    s_energy.on_changed(update_callback)
     # show reset button
     resetax = pl.axes([0.5, 0.025, 0.1, 0.04])
     reset_button = Button(resetax, 'Reset', color='lightgoldenrodyellow', hovercolor='0.975')
@@ -127,29 +372,17 @@ def show_plot():
 
 def updateOnClick(val):
     global plot
-    print "new value", s_energy.val
+    print("new value", s_energy.val)
     assumed_energy = s_energy.val
-    isEvenSolution = None
-    index = 0
-    while index < len(energy_eigen_values):
-        if(assumed_energy <= energy_eigen_values[index]):
-            print assumed_energy, energy_eigen_values[index], index
-            if index % 2 == 0:
-                isEvenSolution = True
-            else:
-                isEvenSolution = False
-            break
-        index += 1
-    print assumed_energy, isEvenSolution
-    calculate_psi(assumed_energy, isEvenSolution)
-    plot.set_ydata(psi_u_array)
-    x_scale = len(xaxis) / 10
-    axes.xaxis.set_ticks(np.arange(min(xaxis), max(xaxis), x_scale))
-    y_scale = abs(max(psi_u_array) - min(psi_u_array)) / 4
-    axes.yaxis.set_ticks(np.arange(min(psi_u_array), max(psi_u_array), min(y_scale, 1)))
+    # eigen values are shown exactly, other energies to the cache resolution
+    assumed_energy, psi = psi_cache.get(assumed_energy, assumed_energy in energy_eigen_values)
+    psi_u_array[:] = psi
+    plot.set_ydata(psi)
+    axes.yaxis.set_ticks(interactive.psi_ticks(psi))
     axes.relim()
     axes.autoscale_view(True, True, True)
-    pl.draw()
+    axes.figure.canvas.draw_idle()
+    calculate_expectation(assumed_energy)
 
 
 def resetOnClick(event):
@@ -173,17 +406,55 @@ def nextOnClick(event):
     s_energy.set_val(energy_eigen_values[displayed_energy_eigen_index])
 
 
-def main():
-    global displayed_energy_eigen_index
-    energy_lower_limit = 0
-    energy_upper_limit = 10
-    energy_interval = 0.00001
-    calculate_eigen_psi(energy_lower_limit, energy_upper_limit, energy_interval)
+def main(argv=None):
+    global displayed_energy_eigen_index, eigen_cache
+    parser = batch.argument_parser('Symmetric one dimensional potential solved by shooting.')
+    parser.add_argument('--lower', type=float, default=0, help='lowest energy to search')
+    parser.add_argument('--upper', type=float, default=10, help='highest energy to search')
+    parser.add_argument('--interval', type=float,
+                        help='energy step of the scan, or of the coarse grid for bracket '
+                        'and matching (default: 0.00001 for loop, 0.05 otherwise)')
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help='eigen value accuracy for the bracket and matching methods')
+    parser.add_argument('--method', default='loop',
+                        choices=['loop', 'bracket', 'matching', 'tridiagonal', 'parallel'])
+    parser.add_argument('--integrator', default='euler', choices=shooting.INTEGRATORS)
+    parser.add_argument('--workers', type=int,
+                        help='worker processes for the parallel method (default: one per CPU)')
+    parser.add_argument('--divisions', type=int, default=positive_x_limit,
+                        help='number of divisions on each side of 0')
+    parser.add_argument('--length', type=float, default=total_x_length,
+                        help='total length on x axis to calculate for')
+    parser.add_argument('--slope', type=float, default=potential_slope,
+                        help='potential is slope * |x|')
+    cache.add_arguments(parser)
+    args = batch.parse_arguments(parser, argv)
+    if args.interval is None:
+        # the loop keeps the step of the original scan, the other methods only need a
+        # coarse grid
+        args.interval = 0.00001 if args.method == 'loop' else 0.05
+    if args.method == 'parallel' and sys.version_info < (3, 7):
+        parser.error('--method parallel needs python 3.7 or later')
+    set_constants(args.divisions, args.length, args.slope)
+    eigen_cache = cache.open_cache(args)
+    if eigen_cache is None:
+        calculate_eigen_psi(args.lower, args.upper, args.interval, method=args.method,
+                            tolerance=args.tolerance, integrator=args.integrator,
+                            workers=args.workers)
+    else:
+        calculate_eigen_psi_cached(args.lower, args.upper, args.interval, method=args.method,
+                                   tolerance=args.tolerance, integrator=args.integrator,
+                                   workers=args.workers)
+    if args.output:
+        save_results(args.output, args)
+    if args.headless:
+        return
     if len(energy_eigen_values) != 0:
-        calculate_psi(energy_eigen_values[0], True)
+        psi_u_array[:] = get_eigen_states()[0]
         displayed_energy_eigen_index = 0
         show_plot()
         s_energy.set_val(energy_eigen_values[displayed_energy_eigen_index])
-    print "Good bye!"
+    print("Good bye!")
 
-main()  # start main function
+if __name__ == '__main__':
+    main()  # start main function
@@ -8,10 +8,52 @@ license: BSD
 Please feel free to use and modify this, but keep the above information. Thanks!
 """
 
+from collections import OrderedDict
+import sys
+
 import numpy as np
-from matplotlib import pyplot as pl
-from matplotlib import animation
 from scipy.fftpack import fft,ifft
+try:
+    # scipy >= 1.4: threaded transforms that can run in place.  Older scipy
+    # has a function scipy.fft instead of the module, which this import
+    # does not pick up.
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+from potentials import theta, square_barrier, absorbing_layer
+import batch
+import crank_nicolson
+import diagnostics
+import observables
+import trajectory
+
+# splitting schemes: the coefficients (a_0, ..., a_m) of the potential and
+# (b_1, ..., b_m) of the kinetic factors of one step of dt,
+#   X(a_m dt) K(b_m dt) ... X(a_1 dt) K(b_1 dt) X(a_0 dt)
+# with X(c) = exp(-i V c / hbar) and K(c) = exp(-i hbar k^2 c / 2m).  All are
+# palindromic, so the last potential factor of a step is merged with the
+# first of the next one.
+_W1 = 1 / (2 - 2 ** (1 / 3.))
+_W0 = 1 - 2 * _W1
+_BM_A = (0.0792036964311957, 0.353172906049774, -0.0420650803577195)
+_BM_B = (0.209515106613362, -0.143851773179818)
+SCHEMES = {
+    # second order Strang splitting
+    'strang': ((0.5, 0.5), (1.0,)),
+    # fourth order triple jump of three Strang steps (Forest & Ruth 1990,
+    # Yoshida 1990)
+    'forest-ruth': ((0.5 * _W1, 0.5 * (_W1 + _W0), 0.5 * (_W1 + _W0), 0.5 * _W1),
+                    (_W1, _W0, _W1)),
+    # fourth order, six stages, with a far smaller error constant (Blanes &
+    # Moan 2002, S6)
+    'blanes-moan': (_BM_A + (1 - 2 * sum(_BM_A),) + _BM_A[::-1],
+                    _BM_B + (0.5 - sum(_BM_B),) * 2 + _BM_B[::-1]),
+}
+SCHEMES['yoshida'] = SCHEMES['forest-ruth']
+ORDERS = {'strang': 2, 'forest-ruth': 4, 'yoshida': 4, 'blanes-moan': 4}
+# step sizes whose factors are kept, so that adaptive stepping between a
+# few sizes does not compute exponentials again
+FACTOR_CACHE_SIZE = 4
 
 
 class Schrodinger(object):
@@ -20,16 +62,21 @@ class Schrodinger(object):
     Schrodinger equation for an arbitrary potential
     """
     def __init__(self, x, psi_x0, V_x,
-                 k0 = None, hbar=1, m=1, t0=0.0):
+                 k0 = None, hbar=1, m=1, t0=0.0, workers=None, dtype=complex,
+                 scheme='strang', absorber=None):
         """
         Parameters
         ----------
         x : array_like, float
             length-N array of evenly spaced spatial coordinates
         psi_x0 : array_like, complex
-            length-N array of the initial wave function at time t0
+            length-N array of the initial wave function at time t0, or an
+            array of shape (..., N) holding an ensemble of wave functions
+            that are evolved together
         V_x : array_like, float
-             length-N array giving the potential at each x
+             length-N array giving the potential at each x, shared by every
+             member of an ensemble, or an array of shape (..., N) giving one
+             potential per member
         k0 : float
             the minimum value of k.  Note that, because of the workings of the
             fast fourier transform, the momentum wave-number will be defined
@@ -44,13 +91,35 @@ class Schrodinger(object):
             particle mass (default = 1)
         t0 : float
             initial tile (default = 0)
+        workers : int, optional
+            number of threads for each fft, -1 for one per CPU.  Only used
+            with scipy >= 1.4; if not specified, one thread.
+        dtype : numpy dtype, optional
+            complex type of the wave function and of the evolution
+            factors (default = complex128).  np.complex64 halves the memory
+            and the traffic through the ffts at the cost of a slow drift
+            of the norm; see ``norm_drift``.
+        scheme : string
+            splitting scheme of time_step, one of ``SCHEMES`` (default =
+            'strang').  The fourth order schemes cost three ('forest-ruth',
+            'yoshida') or six ('blanes-moan') pairs of ffts per step but
+            allow much longer steps at the same accuracy.
+        absorber : array_like, float, optional
+            length-N array of W(x) >= 0 making the potential V(x) - i W(x),
+            zero except in layers at the two ends of the grid (see
+            ``potentials.absorbing_layer``).  What reaches a layer is
+            absorbed instead of being reflected or wrapping around;
+            ``absorbed`` returns how much, and ``monitor`` how much each
+            layer took.
         """
         # Validation of array inputs
         self.x, psi_x0, self.V_x = map(np.asarray, (x, psi_x0, V_x))
         N = self.x.size
         assert self.x.shape == (N,)
-        assert psi_x0.shape == (N,)
-        assert self.V_x.shape == (N,)
+        assert psi_x0.shape[-1:] == (N,)
+        assert self.V_x.shape[-1:] == (N,)
+        # wave functions are rows of shape (N,), transformed along the last axis
+        shape = np.broadcast(psi_x0, self.V_x).shape
 
         # Set internal parameters
         self.hbar = hbar
@@ -68,6 +137,42 @@ class Schrodinger(object):
             self.k0 = k0
         self.k = self.k0 + self.dk * np.arange(self.N)
 
+        # every array touched in a step has this type, so single precision
+        # runs never fall back to double precision arithmetic
+        self.dtype = np.dtype(dtype)
+        assert self.dtype.kind == 'c'
+
+        # phase factors relating psi_x, psi_k to psi_mod_x, psi_mod_k,
+        # computed once per grid:
+        #   psi_x = psi_mod_x * x_phase,  psi_k = psi_mod_k * k_phase
+        x_phase = (np.exp(1j * self.k[0] * self.x)
+                   * np.sqrt(2 * np.pi) / self.dx)
+        k_phase = np.exp(-1j * self.x[0] * self.dk * np.arange(self.N))
+        self._x_phase = x_phase.astype(self.dtype)
+        self._x_phase_inverse = (1.0 / x_phase).astype(self.dtype)
+        self._k_phase = k_phase.astype(self.dtype)
+        self._k_phase_inverse = np.conj(k_phase).astype(self.dtype)
+
+        # the absorber and the slices of its layers at the two ends
+        self.absorber = None
+        self._layers = []
+        if absorber is not None:
+            self.absorber = np.asarray(absorber, dtype=float)
+            assert self.absorber.shape == (N,)
+            inside = np.nonzero(self.absorber == 0)[0]
+            assert inside.size > 0
+            self._layers = [('left', slice(0, inside[0])),
+                            ('right', slice(inside[-1] + 1, N))]
+
+        # the wave function lives in two buffers that are transformed in
+        # place; psi_mod_k is only brought up to date when it is read
+        self.workers = workers
+        self._psi_mod_x = np.zeros(shape, dtype=self.dtype)
+        self._psi_mod_k = np.zeros(shape, dtype=self.dtype)
+        self._k_current = False
+        # norm of the wave function when time_step first ran after it was set
+        self._norm_reference = None
+
         self.psi_x = psi_x0
         self.compute_k_from_x()
 
@@ -75,6 +180,15 @@ class Schrodinger(object):
         self.x_evolve_half = None
         self.x_evolve = None
         self.k_evolve = None
+        self.scheme = scheme
+        self._set_scheme_factors(None)
+        self._factor_cache = OrderedDict()
+        self._factor_cache_size = FACTOR_CACHE_SIZE
+        self._adaptive_level = None
+
+        # steps taken so far and the Diagnostics sampling them, if any
+        self.steps = 0
+        self.diagnostics = None
 
         # attributes used for dynamic plotting
         self.psi_x_line = None
@@ -82,42 +196,210 @@ class Schrodinger(object):
         self.V_x_line = None
 
     def _set_psi_x(self, psi_x):
-        self.psi_mod_x = (psi_x * np.exp(-1j * self.k[0] * self.x)
-                          * self.dx / np.sqrt(2 * np.pi))
+        np.multiply(psi_x, self._x_phase_inverse, out=self._psi_mod_x,
+                    casting='same_kind')
+        self._k_current = False
+        self._norm_reference = None
 
     def _get_psi_x(self):
-        return (self.psi_mod_x * np.exp(1j * self.k[0] * self.x)
-                * np.sqrt(2 * np.pi) / self.dx)
+        return self.get_psi_x()
 
     def _set_psi_k(self, psi_k):
-        self.psi_mod_k = psi_k * np.exp(1j * self.x[0]
-                                        * self.dk * np.arange(self.N))
+        np.multiply(psi_k, self._k_phase_inverse, out=self._psi_mod_k,
+                    casting='same_kind')
+        self._k_current = True
+        self._norm_reference = None
 
     def _get_psi_k(self):
-        return self.psi_mod_k * np.exp(-1j * self.x[0] * 
-                                        self.dk * np.arange(self.N))
-    
+        return self.get_psi_k()
+
+    def get_psi_x(self, out=None):
+        """
+        Return psi(x), written into out if it is given.
+
+        out must be a complex array shaped like the wave functions.  Reading
+        the psi_x property is the same as calling this without out.
+        """
+        return np.multiply(self._psi_mod_x, self._x_phase, out=out)
+
+    def get_psi_k(self, out=None):
+        "return psi(k), written into out if it is given (see get_psi_x)"
+        return np.multiply(self.psi_mod_k, self._k_phase, out=out)
+
+    def abs_psi_x(self, out=None):
+        """
+        Return |psi(x)|, written into out if it is given.
+
+        The phase factors have modulus one, so no complex exponential or
+        complex temporary is needed.  out must be a float array shaped like
+        the wave functions; float32 is enough for the complex64 dtype.
+        """
+        out = np.abs(self._psi_mod_x, out=out)
+        out *= np.sqrt(2 * np.pi) / self.dx
+        return out
+
+    def abs_psi_k(self, out=None):
+        "return |psi(k)|, written into out if it is given (see abs_psi_x)"
+        return np.abs(self.psi_mod_k, out=out)
+
     def _get_dt(self):
         return self.dt_
 
     def _set_dt(self, dt):
         if dt != self.dt_:
             self.dt_ = dt
-            self.x_evolve_half = np.exp(-0.5 * 1j * self.V_x
-                                         / self.hbar * dt )
-            self.x_evolve = self.x_evolve_half * self.x_evolve_half
-            self.k_evolve = np.exp(-0.5 * 1j * self.hbar /
-                                    self.m * (self.k * self.k) * dt)
+            # the factors of the last few step sizes are kept
+            factors = self._factor_cache.pop(dt, None)
+            if factors is None:
+                factors = self._step_factors(dt)
+            self._factor_cache[dt] = factors
+            while len(self._factor_cache) > self._factor_cache_size:
+                self._factor_cache.popitem(last=False)
+            self._set_scheme_factors(factors)
+
+    def _set_scheme_factors(self, factors):
+        if factors is None:
+            factors = (None, None, None)
+        self._x_stages, self._x_merged, self._k_stages = factors
+        if factors[0] is not None:
+            # for strang, the usual half step, step and kinetic factors
+            self.x_evolve_half = self._x_stages[0]
+            self.x_evolve = self._x_merged
+            self.k_evolve = self._k_stages[0]
+
+    def _x_factor(self, c):
+        "returns X(c) = exp(-i V c / hbar), computed in double precision and cast"
+        if self.absorber is None:
+            return np.exp(-1j * self.V_x / self.hbar * c).astype(self.dtype)
+        return np.exp((-1j * self.V_x - self.absorber) / self.hbar
+                      * c).astype(self.dtype)
+
+    def _k_factor(self, c):
+        "returns K(c) = exp(-i hbar k^2 c / 2m), computed in double precision and cast"
+        return np.exp(-0.5 * 1j * self.hbar / self.m * (self.k * self.k)
+                      * c).astype(self.dtype)
+
+    def _merged_x_factor(self, c):
+        "returns the factor applied between two steps, X(c)"
+        return self._x_factor(c)
+
+    def _step_factors(self, dt):
+        """
+        Return the potential factors of every stage of a step of dt, the
+        merged factor between two steps and the kinetic factors.  Stages
+        with the same coefficient share one array.
+        """
+        a, b = SCHEMES[self.scheme]
+        x_factors = {}
+        k_factors = {}
+        for c in a:
+            if c not in x_factors:
+                x_factors[c] = self._x_factor(c * dt)
+        for c in b:
+            if c not in k_factors:
+                k_factors[c] = self._k_factor(c * dt)
+        return ([x_factors[c] for c in a],
+                self._merged_x_factor((a[-1] + a[0]) * dt),
+                [k_factors[c] for c in b])
     
+    def _get_psi_mod_x(self):
+        return self._psi_mod_x
+
+    def _set_psi_mod_x(self, psi_mod_x):
+        self._psi_mod_x[...] = psi_mod_x
+        self._k_current = False
+        self._norm_reference = None
+
+    def _get_psi_mod_k(self):
+        if not self._k_current:
+            self.compute_k_from_x()
+        return self._psi_mod_k
+
+    def _set_psi_mod_k(self, psi_mod_k):
+        self._psi_mod_k[...] = psi_mod_k
+        self._k_current = True
+        self._norm_reference = None
+
     psi_x = property(_get_psi_x, _set_psi_x)
     psi_k = property(_get_psi_k, _set_psi_k)
+    psi_mod_x = property(_get_psi_mod_x, _set_psi_mod_x)
+    psi_mod_k = property(_get_psi_mod_k, _set_psi_mod_k)
     dt = property(_get_dt, _set_dt)
 
+    def _transform(self, psi, inverse=False):
+        """
+        Replace the contents of psi by its fft (or inverse fft).  With
+        scipy.fft the transform runs in place and allocates nothing.
+        """
+        if scipy_fft is not None:
+            transform = scipy_fft.ifft if inverse else scipy_fft.fft
+            result = transform(psi, overwrite_x=True, workers=self.workers)
+        else:
+            transform = ifft if inverse else fft
+            result = transform(psi, overwrite_x=True)
+        if not np.may_share_memory(result, psi):
+            psi[...] = result
+
+    def _evolve_x(self, psi, factor):
+        "apply a potential factor to psi in place"
+        psi *= factor
+
+    def _evolve_k(self, psi, factor):
+        "apply a kinetic factor to psi, in the k representation, in place"
+        psi *= factor
+
     def compute_k_from_x(self):
-        self.psi_mod_k = fft(self.psi_mod_x)
+        self._psi_mod_k[...] = self._psi_mod_x
+        self._transform(self._psi_mod_k)
+        self._k_current = True
 
     def compute_x_from_k(self):
-        self.psi_mod_x = ifft(self.psi_mod_k)
+        self._psi_mod_x[...] = self._psi_mod_k
+        self._transform(self._psi_mod_x, inverse=True)
+
+    def norm(self):
+        """
+        Return sum(|psi(x)|^2) dx, accumulated in double precision whatever
+        the dtype; for an ensemble, one value per member.
+        """
+        density = self.abs_psi_x()
+        density *= density
+        return np.sum(density, axis=-1, dtype=float) * self.dx
+
+    def norm_drift(self):
+        """
+        Return norm() / norm_0 - 1, where norm_0 is the norm when time_step
+        first ran after the wave function was last set.
+
+        The exact evolution is unitary, so this is the rounding error that
+        has built up, which is what the complex64 dtype trades for speed,
+        plus whatever an absorber has taken (see ``absorbed``).  Zero
+        before the first step.
+        """
+        if self._norm_reference is None:
+            return np.zeros(self._psi_mod_x.shape[:-1])
+        return self.norm() / self._norm_reference - 1
+
+    def absorbed(self):
+        """
+        Return the probability taken by the absorber since time_step first
+        ran after the wave function was last set, norm_0 - norm().  The
+        rest of the evolution keeps the norm, so nothing per step is needed;
+        ``monitor`` splits it between the two layers.
+        """
+        if self._norm_reference is None:
+            return np.zeros(self._psi_mod_x.shape[:-1])
+        return self._norm_reference - self.norm()
+
+    def expectation_values(self):
+        """
+        Return the expectation values of the current wave function.
+
+        See ``observables.expectation_values`` for the keys of the
+        returned dict.
+        """
+        return observables.expectation_values(self.psi_x, self.dx, self.x,
+                                              self.V_x, self.hbar, self.m)
 
     def time_step(self, dt, Nsteps = 1):
         """
@@ -134,25 +416,303 @@ class Schrodinger(object):
             default is N = 1
         """
         self.dt = dt
+        if self._norm_reference is None:
+            self._norm_reference = self.norm()
 
+        # the whole loop runs in the x buffer: each fft turns it into the
+        # k representation and each inverse fft back, in place.  The last
+        # potential factor of a step and the first of the next are merged.
+        psi = self._psi_mod_x
+        x_stages = self._x_stages
+        k_stages = self._k_stages
+        stages = len(k_stages)
+        probe = self.diagnostics
         if Nsteps > 0:
-            self.psi_mod_x *= self.x_evolve_half
+            self._evolve_x(psi, x_stages[0])
 
-        for i in xrange(Nsteps - 1):
-            self.compute_k_from_x()
-            self.psi_mod_k *= self.k_evolve
-            self.compute_x_from_k()
-            self.psi_mod_x *= self.x_evolve
+        for i in range(Nsteps):
+            sample = probe is not None and probe.due(self.steps + i)
+            if sample and stages == 1:
+                probe.before_step(psi)
+            for j in range(stages):
+                self._transform(psi)
+                self._evolve_k(psi, k_stages[j])
+                if sample and stages == 1:
+                    probe.kinetic(psi)
+                self._transform(psi, inverse=True)
+                if j < stages - 1:
+                    self._evolve_x(psi, x_stages[j + 1])
+            if sample:
+                if stages == 1:
+                    probe.after_step(psi, self.t + dt * (i + 1))
+                else:
+                    self._sample(psi, self.t + dt * (i + 1), x_stages[-1])
+            if i == Nsteps - 1:
+                self._evolve_x(psi, x_stages[-1])
+            elif self._x_merged is not None:
+                self._evolve_x(psi, self._x_merged)
+            else:
+                self._evolve_x(psi, x_stages[-1])
+                self._evolve_x(psi, x_stages[0])
 
-        self.compute_k_from_x()
-        self.psi_mod_k *= self.k_evolve
+        # psi_mod_k is recomputed the next time it is read
+        self._k_current = False
 
-        self.compute_x_from_k()
-        self.psi_mod_x *= self.x_evolve_half
+        self.t += dt * Nsteps
+        self.steps += Nsteps
 
-        self.compute_k_from_x()
+    def _sample(self, psi, t, factor=None):
+        """
+        Give the diagnostics the wave function at t, which is psi times
+        factor (if given), with an fft of its own for the kinetic energy.
+        Used where no step of a single kinetic stage brackets t.
+        """
+        probe = self.diagnostics
+        psi_k = self._psi_mod_k
+        if factor is None:
+            psi_k[...] = psi
+        else:
+            np.multiply(psi, factor, out=psi_k)
+        probe.before_step(psi_k)
+        self._transform(psi_k)
+        probe.kinetic(psi_k)
+        self._transform(psi_k, inverse=True)
+        probe.after_step(psi_k, t)
 
-        self.t += dt * Nsteps
+    def time_step_adaptive(self, duration, tolerance, dt=None, max_level=30):
+        """
+        Advance the wave function by duration with steps chosen by step
+        doubling.
+
+        Each trial compares one step of h with two steps of h / 2, takes
+        the difference of the two, scaled by 1 / (2^p - 1) for a scheme of
+        order p, as the error of the two small steps, and keeps them if the
+        error is below tolerance.  The steps are h = duration / 2^level, and
+        h only doubles where a step of 2h would start, so duration is
+        reached exactly and only a few step sizes ever occur: their
+        factors stay in the cache of ``_set_dt`` across calls.
+
+        Parameters
+        ----------
+        duration : float
+            time to advance by
+        tolerance : float
+            largest accepted error of a step, as the norm of the difference
+            of the wave functions (the largest over an ensemble)
+        dt : float, optional
+            first step to try.  If not specified, the step reached at the
+            end of the last call, or duration itself.
+        max_level : int
+            finest division of duration tried before giving up
+
+        Returns
+        -------
+        steps : int
+            number of accepted steps (of h / 2).  Diagnostics count these
+            too, and sample after each pair of which one is due.
+        """
+        order = ORDERS[self.scheme]
+        if dt is not None:
+            level = max(0, int(np.ceil(np.log2(duration / float(dt)))))
+        elif self._adaptive_level is not None:
+            level = self._adaptive_level
+        else:
+            level = 0
+        start = np.empty_like(self._psi_mod_x)
+        coarse = np.empty_like(self._psi_mod_x)
+        probe = self.diagnostics
+        cell = np.prod(self.dx) * np.prod(2 * np.pi / (self.dx * self.dx))
+        t_end = self.t + duration
+        position = 0
+        steps = 0
+        while position < 2 ** level:
+            h = duration / 2. ** level
+            t = self.t
+            self.diagnostics = None
+            start[...] = self._psi_mod_x
+            self.time_step(h)
+            coarse[...] = self._psi_mod_x
+            self._psi_mod_x[...] = start
+            self.t = t
+            self.steps -= 1
+            self.time_step(0.5 * h, 2)
+            self.diagnostics = probe
+            coarse -= self._psi_mod_x
+            density = np.abs(coarse)
+            density *= density
+            grid_axes = tuple(range(-np.size(self.dx), 0))
+            error = np.sqrt(np.max(np.sum(density, axis=grid_axes,
+                                          dtype=float)) * cell)
+            error /= 2 ** order - 1
+
+            if error > tolerance:
+                # reject: restore and halve
+                if level >= max_level:
+                    raise ValueError("tolerance %g not reached with steps "
+                                     "of %g" % (tolerance, h))
+                self._psi_mod_x[...] = start
+                self.t = t
+                self.steps -= 2
+                level += 1
+                position *= 2
+                continue
+
+            steps += 2
+            position += 1
+            if probe is not None and (probe.due(self.steps - 2)
+                                      or probe.due(self.steps - 1)):
+                self._sample(self._psi_mod_x, self.t)
+            # double h if a step of 2h would have passed, starting at a
+            # multiple of 2h
+            if (error * 2 ** (order + 1) < 0.5 * tolerance and level > 0
+                    and position % 2 == 0):
+                level -= 1
+                position //= 2
+        self.t = t_end
+        self._k_current = False
+        self._adaptive_level = level
+        return steps
+
+    def find_eigenstates(self, n, tol=1e-8, dt=0.1, check_every=10,
+                         max_steps=100000, psi0=None):
+        """
+        Find the lowest n eigenvalues and eigenstates of the Hamiltonian by
+        propagating in imaginary time.
+
+        A Strang step of dt = -i tau is exp(-H tau) up to the splitting
+        error, which damps every state by exp(-E tau), so a set of n wave
+        functions kept orthonormal (Gram-Schmidt after every step, each
+        against the lower ones) tends to the n lowest states.  Every
+        check_every steps the Hamiltonian is diagonalized on their span
+        (Rayleigh-Ritz), which also separates states that are close in
+        energy.  Once the energies change by less than tol between checks,
+        tau is halved, until halving changes them by less than tol too: the
+        energies of the Strang splitting are off by O(tau^4).  The fourth
+        order schemes have negative kinetic coefficients, which blow up in
+        imaginary time, so Strang is used whatever the scheme.
+
+        Only the wave functions found are new; this object, its psi and
+        its time are left as they were.  The potential is V_x, which must
+        be shared by the whole ensemble; an absorber is ignored.  The grid
+        Hamiltonian has a spectral kinetic term, so for smooth potentials
+        a coarse grid already gives energies that the shooting solvers only
+        reach on a far finer one.
+
+        Parameters
+        ----------
+        n : int
+            number of states
+        tol : float
+            convergence threshold on the energies (default = 1e-8)
+        dt : float
+            first imaginary time step tau (default = 0.1)
+        check_every : int
+            steps between Rayleigh-Ritz diagonalizations and convergence
+            checks (default = 10)
+        max_steps : int
+            steps, over all values of tau, before giving up
+        psi0 : array_like, complex, optional
+            (n, N) array of starting wave functions.  If not specified,
+            random functions confined to the middle half of the grid,
+            which overlap with every state.
+
+        Returns
+        -------
+        energies : ndarray, float
+            length-n array of the eigenvalues in increasing order
+        psi : ndarray, complex
+            (n, N) array of the eigenstates, normalized so that
+            sum(|psi|^2) dx = 1, with the largest value of each real and
+            positive
+        """
+        assert self.V_x.shape == self.x.shape
+        if psi0 is None:
+            random = np.random.RandomState(0)
+            center = 0.5 * (self.x[0] + self.x[-1])
+            width = 0.25 * (self.x[-1] - self.x[0])
+            psi0 = (random.standard_normal((n, self.N))
+                    * np.exp(-((self.x - center) / width) ** 2))
+        work = Schrodinger(self.x, psi0, self.V_x, k0=self.k0, hbar=self.hbar,
+                           m=self.m, workers=self.workers, dtype=self.dtype)
+        psi = work._psi_mod_x
+        psi[...] = np.linalg.qr(psi.T)[0].T
+        kinetic = 0.5 * self.hbar * self.hbar / self.m * (self.k * self.k)
+
+        energies = None
+        converged = None
+        steps = 0
+        while True:
+            if steps >= max_steps:
+                raise ValueError("energies not converged to %g in %d steps"
+                                 % (tol, max_steps))
+            for i in range(check_every):
+                work.time_step(-1j * dt)
+                # Gram-Schmidt as a Cholesky factorization of the overlaps,
+                # far cheaper than a QR of the whole (n, N) array once the
+                # functions are close to orthonormal
+                try:
+                    lower = np.linalg.cholesky(np.dot(psi, psi.conj().T))
+                    psi[...] = np.dot(np.linalg.inv(lower), psi)
+                except np.linalg.LinAlgError:
+                    psi[...] = np.linalg.qr(psi.T)[0].T
+            steps += check_every
+
+            # Rayleigh-Ritz, in double precision whatever the dtype
+            basis = psi.astype(complex)
+            H_psi = basis.copy()
+            work._transform(H_psi)
+            H_psi *= kinetic
+            work._transform(H_psi, inverse=True)
+            H_psi += self.V_x * basis
+            H = np.dot(basis.conj(), H_psi.T)
+            previous = energies
+            energies, vectors = np.linalg.eigh(0.5 * (H + H.conj().T))
+            psi[...] = np.dot(vectors.T, basis)
+
+            if previous is None or np.max(abs(energies - previous)) >= tol:
+                continue
+            if (converged is not None
+                    and np.max(abs(energies - converged)) < tol):
+                break
+            converged = energies
+            dt *= 0.5
+
+        psi_x = work.psi_x.astype(complex)
+        peaks = psi_x[np.arange(n), np.argmax(abs(psi_x), axis=-1)]
+        psi_x *= abs(peaks)[:, None] / peaks[:, None]
+        psi_x /= np.sqrt(np.sum(abs(psi_x) ** 2, axis=-1) * self.dx)[:, None]
+        return energies, psi_x
+
+    def monitor(self, every=1, regions=None):
+        """
+        Sample norm, <V>, <T>, <H> and the probability in each region every
+        `every` steps from inside time_step, and return the
+        ``diagnostics.Diagnostics`` collecting them.  It replaces any that
+        was attached before; set the diagnostics attribute to None to stop.
+        """
+        self.diagnostics = diagnostics.Diagnostics(self, every, regions)
+        return self.diagnostics
+
+    def run(self, dt, n_steps, every=1, tolerance=None):
+        """
+        Generator advancing the wave function by n_steps steps of dt, which
+        yields after every `every` steps, and after the last step.
+
+        What is yielded is this object itself, so a snapshot has to be read
+        (e.g. with abs_psi_x(out=...)) before the generator is resumed.
+        The steps between snapshots run in one call of time_step, or, if a
+        tolerance is given, of time_step_adaptive over the same time with
+        dt as the first step tried.
+        """
+        done = 0
+        while done < n_steps:
+            steps = min(every, n_steps - done)
+            if tolerance is None:
+                self.time_step(dt, steps)
+            else:
+                self.time_step_adaptive(dt * steps, tolerance, dt=dt)
+            done += steps
+            yield self
 
 
 ######################################################################
@@ -174,136 +734,378 @@ def gauss_k(k,a,x0,k0):
 
 
 ######################################################################
-# Utility functions for running the animation
+# Create the animation
 
-def theta(x):
+def barrier_simulation(N=2 ** 11, dx=0.1, V0=1.5, hbar=1.0, m=1.9,
+                       workers=None, dtype=complex, scheme='strang',
+                       absorbing_width=None, absorbing_strength=5.0):
     """
-    theta function :
-      returns 0 if x<=0, and 1 if x>0
+    Set up a gaussian wave packet running into a square barrier.
+
+    The grid is closed by hard walls at x = +-98 unless absorbing_width
+    is given, in which case absorbing layers of that width and strength
+    (see ``potentials.absorbing_layer``) line both of its ends instead, and
+    the grid may be much smaller.
+
+    Returns the Schrodinger object together with the initial packet
+    center x0 and momentum p0.
     """
-    x = np.asarray(x)
-    y = np.zeros(x.shape)
-    y[x > 0] = 1.0
-    return y
+    # specify range in x coordinate
+    x = dx * (np.arange(N) - 0.5 * N)
 
-def square_barrier(x, width, height):
-    return height * (theta(x) - theta(x - width))
+    # specify potential
+    L = hbar / np.sqrt(2 * m * V0)
+    a = 3 * L
+    x0 = -60 * L
+    V_x = square_barrier(x, a, V0)
+    if absorbing_width is None:
+        V_x[x < -98] = 1E6
+        V_x[x > 98] = 1E6
+        absorber = None
+    else:
+        absorber = absorbing_layer(x, absorbing_width, absorbing_strength)
 
-######################################################################
-# Create the animation
+    # specify initial momentum and quantities derived from it
+    p0 = np.sqrt(2 * m * 0.2 * V0)
+    dp2 = p0 * p0 * 1./80
+    d = hbar / np.sqrt(2 * dp2)
 
-# specify time steps and duration
-dt = 0.01
-N_steps = 50
-t_max = 120
-frames = int(t_max / float(N_steps * dt))
-
-# specify constants
-hbar = 1.0   # planck's constant
-m = 1.9      # particle mass
-
-# specify range in x coordinate
-N = 2 ** 11
-dx = 0.1
-x = dx * (np.arange(N) - 0.5 * N)
-
-# specify potential
-V0 = 1.5
-L = hbar / np.sqrt(2 * m * V0)
-a = 3 * L
-x0 = -60 * L
-V_x = square_barrier(x, a, V0)
-V_x[x < -98] = 1E6
-V_x[x > 98] = 1E6
-
-# specify initial momentum and quantities derived from it
-p0 = np.sqrt(2 * m * 0.2 * V0)
-dp2 = p0 * p0 * 1./80
-d = hbar / np.sqrt(2 * dp2)
-
-k0 = p0 / hbar
-v0 = p0 / m
-psi_x0 = gauss_x(x, d, x0, k0)
-
-# define the Schrodinger object which performs the calculations
-S = Schrodinger(x=x,
-                psi_x0=psi_x0,
-                V_x=V_x,
-                hbar=hbar,
-                m=m,
-                k0=-28)
+    k0 = p0 / hbar
+    psi_x0 = gauss_x(x, d, x0, k0)
 
-######################################################################
-# Set up plot
-fig = pl.figure()
-
-# plotting limits
-xlim = (-100, 100)
-klim = (-5, 5)
-
-# top axes show the x-space data
-ymin = 0
-ymax = V0
-ax1 = fig.add_subplot(211, xlim=xlim,
-                      ylim=(ymin - 0.2 * (ymax - ymin),
-                            ymax + 0.2 * (ymax - ymin)))
-psi_x_line, = ax1.plot([], [], c='r', label=r'$|\psi(x)|$')
-V_x_line, = ax1.plot([], [], c='k', label=r'$V(x)$')
-center_line = ax1.axvline(0, c='k', ls=':',
-                          label = r"$x_0 + v_0t$")
-
-title = ax1.set_title("")
-ax1.legend(prop=dict(size=12))
-ax1.set_xlabel('$x$')
-ax1.set_ylabel(r'$|\psi(x)|$')
-
-# bottom axes show the k-space data
-ymin = abs(S.psi_k).min()
-ymax = abs(S.psi_k).max()
-ax2 = fig.add_subplot(212, xlim=klim,
-                      ylim=(ymin - 0.2 * (ymax - ymin),
-                            ymax + 0.2 * (ymax - ymin)))
-psi_k_line, = ax2.plot([], [], c='r', label=r'$|\psi(k)|$')
-
-p0_line1 = ax2.axvline(-p0 / hbar, c='k', ls=':', label=r'$\pm p_0$')
-p0_line2 = ax2.axvline(p0 / hbar, c='k', ls=':')
-mV_line = ax2.axvline(np.sqrt(2 * V0) / hbar, c='k', ls='--',
-                      label=r'$\sqrt{2mV_0}$')
-ax2.legend(prop=dict(size=12))
-ax2.set_xlabel('$k$')
-ax2.set_ylabel(r'$|\psi(k)|$')
-
-V_x_line.set_data(S.x, S.V_x)
+    # define the Schrodinger object which performs the calculations
+    S = Schrodinger(x=x,
+                    psi_x0=psi_x0,
+                    V_x=V_x,
+                    hbar=hbar,
+                    m=m,
+                    k0=-28,
+                    workers=workers,
+                    dtype=dtype,
+                    scheme=scheme,
+                    absorber=absorber)
+    return S, x0, p0
+
+
+def barrier_ensemble(V0, width=None, p0=None, N=2 ** 11, dx=0.1, hbar=1.0,
+                     m=1.9, workers=None, dtype=complex, scheme='strang'):
+    """
+    Set up the packet and barrier of ``barrier_simulation`` for every point
+    of a parameter sweep, as one ensemble.
+
+    V0, width and p0 are broadcast against each other and every element of
+    the result is one member.  If not specified, width is three decay
+    lengths hbar / sqrt(2 m V0) and p0 = sqrt(2 m 0.2 V0), as in
+    ``barrier_simulation``.
+
+    Returns the Schrodinger object together with the initial packet
+    centers x0 and momenta p0, shaped like the ensemble.
+    """
+    V0 = np.asarray(V0, dtype=float)
+    decay_length = hbar / np.sqrt(2 * m * V0)
+    if width is None:
+        width = 3 * decay_length
+    if p0 is None:
+        p0 = np.sqrt(2 * m * 0.2 * V0)
+    V0, width, p0, decay_length = np.broadcast_arrays(V0, width, p0,
+                                                      decay_length)
+    # one row per member, with the packet and barrier of barrier_simulation
+    x = dx * (np.arange(N) - 0.5 * N)
+    x0 = -60 * decay_length
+    V_x = square_barrier(x, width[..., None], V0[..., None])
+    V_x[..., (x < -98) | (x > 98)] = 1E6
+    d = hbar / np.sqrt(2 * p0 * p0 / 80.)
+    psi_x0 = gauss_x(x, d[..., None], x0[..., None], p0[..., None] / hbar)
+
+    S = Schrodinger(x=x,
+                    psi_x0=psi_x0,
+                    V_x=V_x,
+                    hbar=hbar,
+                    m=m,
+                    k0=-28,
+                    workers=workers,
+                    dtype=dtype,
+                    scheme=scheme)
+    return S, x0, p0
+
+
+def barrier_regions(V0, hbar=1.0, m=1.9):
+    """
+    Return the regions in front of and behind the barrier of
+    ``barrier_simulation``, inside the walls, for ``Schrodinger.monitor``
+    """
+    width = 3 * hbar / np.sqrt(2 * m * V0)
+    return {'reflected': (-98, 0), 'transmitted': (width, 98)}
+
+
+def transmission(S, x_min):
+    """
+    Return the probability of finding the particle beyond x_min, for every
+    member of an ensemble.  x_min is broadcast against the ensemble.
+    """
+    density = S.abs_psi_x() ** 2
+    beyond = S.x > np.asarray(x_min)[..., None]
+    return np.sum(density * beyond, axis=-1) * S.dx
+
+
+def run_headless(S, dt, N_steps, frames, tolerance=None, recorder=None):
+    """
+    Advance S by frames * N_steps steps of dt without plotting, or with
+    adaptive steps over the same frames, starting each from a step of dt,
+    if a tolerance is given.  If a
+    ``trajectory.Recorder`` is given, every frame is also written to it.
+
+    Returns the time and the expectation values after every frame, along
+    with 'norm_drift' (see ``Schrodinger.norm_drift``); for an ensemble
+    every value is an array of shape (frames,) + ensemble shape.
+    """
+    t = np.zeros(frames)
+    values = dict((name, []) for name in observables.NAMES + ('norm_drift',))
+    for i in range(frames):
+        if tolerance is None:
+            S.time_step(dt, N_steps)
+        else:
+            S.time_step_adaptive(dt * N_steps, tolerance, dt=dt)
+        t[i] = S.t
+        if recorder is not None:
+            recorder.write(S)
+        for name, value in S.expectation_values().items():
+            values[name].append(value)
+        values['norm_drift'].append(S.norm_drift())
+    return t, dict((name, np.array(value)) for name, value in values.items())
+
+
+def show_animation(S, dt, N_steps, frames, x0, p0, V0, tolerance=None):
+    from matplotlib import pyplot as pl
+    from matplotlib import animation
+
+    ######################################################################
+    # Set up plot
+    fig = pl.figure()
+
+    # plotting limits
+    xlim = (-100, 100)
+    klim = (-5, 5)
+
+    # top axes show the x-space data
+    ymin = 0
+    ymax = V0
+    ax1 = fig.add_subplot(211, xlim=xlim,
+                          ylim=(ymin - 0.2 * (ymax - ymin),
+                                ymax + 0.2 * (ymax - ymin)))
+    psi_x_line, = ax1.plot([], [], c='r', label=r'$|\psi(x)|$')
+    V_x_line, = ax1.plot([], [], c='k', label=r'$V(x)$')
+    center_line = ax1.axvline(0, c='k', ls=':',
+                              label = r"$x_0 + v_0t$")
+
+    title = ax1.set_title("")
+    ax1.legend(prop=dict(size=12))
+    ax1.set_xlabel('$x$')
+    ax1.set_ylabel(r'$|\psi(x)|$')
+
+    # bottom axes show the k-space data
+    ymin = S.abs_psi_k().min()
+    ymax = S.abs_psi_k().max()
+    ax2 = fig.add_subplot(212, xlim=klim,
+                          ylim=(ymin - 0.2 * (ymax - ymin),
+                                ymax + 0.2 * (ymax - ymin)))
+    psi_k_line, = ax2.plot([], [], c='r', label=r'$|\psi(k)|$')
+
+    p0_line1 = ax2.axvline(-p0 / S.hbar, c='k', ls=':', label=r'$\pm p_0$')
+    p0_line2 = ax2.axvline(p0 / S.hbar, c='k', ls=':')
+    mV_line = ax2.axvline(np.sqrt(2 * V0) / S.hbar, c='k', ls='--',
+                          label=r'$\sqrt{2mV_0}$')
+    ax2.legend(prop=dict(size=12))
+    ax2.set_xlabel('$k$')
+    ax2.set_ylabel(r'$|\psi(k)|$')
 
-######################################################################
-# Animate plot
-def init():
-    psi_x_line.set_data([], [])
-    V_x_line.set_data([], [])
-    center_line.set_data([], [])
-
-    psi_k_line.set_data([], [])
-    title.set_text("")
-    return (psi_x_line, V_x_line, center_line, psi_k_line, title)
-
-def animate(i):
-    S.time_step(dt, N_steps)
-    psi_x_line.set_data(S.x, 4 * abs(S.psi_x))
     V_x_line.set_data(S.x, S.V_x)
-    center_line.set_data(2 * [x0 + S.t * p0 / m], [0, 1])
 
-    psi_k_line.set_data(S.k, abs(S.psi_k))
-    title.set_text("t = %.2f" % S.t)
-    return (psi_x_line, V_x_line, center_line, psi_k_line, title)
+    ######################################################################
+    # Animate plot
+    def init():
+        psi_x_line.set_data([], [])
+        V_x_line.set_data([], [])
+        center_line.set_data([], [])
+
+        psi_k_line.set_data([], [])
+        title.set_text("")
+        return (psi_x_line, V_x_line, center_line, psi_k_line, title)
 
-# call the animator.  blit=True means only re-draw the parts that have changed.
-anim = animation.FuncAnimation(fig, animate, init_func=init,
-                               frames=frames, interval=30, blit=True)
+    # |psi| of every frame is written into the same two arrays
+    abs_psi_x = np.zeros(S.N)
+    abs_psi_k = np.zeros(S.N)
+
+    def animate(i):
+        if tolerance is None:
+            S.time_step(dt, N_steps)
+        else:
+            S.time_step_adaptive(dt * N_steps, tolerance, dt=dt)
+        S.abs_psi_x(out=abs_psi_x)
+        abs_psi_x *= 4
+        psi_x_line.set_data(S.x, abs_psi_x)
+        V_x_line.set_data(S.x, S.V_x)
+        center_line.set_data(2 * [x0 + S.t * p0 / S.m], [0, 1])
 
+        psi_k_line.set_data(S.k, S.abs_psi_k(out=abs_psi_k))
+        title.set_text("t = %.2f" % S.t)
+        return (psi_x_line, V_x_line, center_line, psi_k_line, title)
 
-# uncomment the following line to save the video in mp4 format.  This
-# requires either mencoder or ffmpeg to be installed on your system
+    # call the animator.  blit=True means only re-draw the parts that have changed.
+    anim = animation.FuncAnimation(fig, animate, init_func=init,
+                                   frames=frames, interval=30, blit=True)
+
+
+    # uncomment the following line to save the video in mp4 format.  This
+    # requires either mencoder or ffmpeg to be installed on your system.
+    # --record DIR --export FILE.mp4 does the same much faster, rendering
+    # the recorded frames on a process pool (see export.py).
+
+    #anim.save('schrodinger_barrier.mp4', fps=15, extra_args=['-vcodec', 'libx264'])
+
+    pl.show()
+
+
+def main(argv=None):
+    parser = batch.argument_parser(
+        'Gaussian wave packet scattering off a square barrier.')
+    # specify time steps and duration
+    parser.add_argument('--dt', type=float, default=0.01)
+    parser.add_argument('--steps-per-frame', type=int, default=50)
+    parser.add_argument('--t-max', type=float, default=120)
+    # specify constants
+    parser.add_argument('--hbar', type=float, default=1.0,
+                        help="planck's constant")
+    parser.add_argument('--mass', type=float, default=1.9,
+                        help='particle mass')
+    # specify range in x coordinate and potential
+    parser.add_argument('--points', type=int, default=2 ** 11,
+                        help='number of grid points')
+    parser.add_argument('--dx', type=float, default=0.1)
+    parser.add_argument('--barrier-height', type=float, default=1.5)
+    parser.add_argument('--fft-workers', type=int,
+                        help='threads per fft, -1 for one per CPU')
+    parser.add_argument('--dtype', default='complex128',
+                        choices=['complex128', 'complex64'],
+                        help='precision of the wave function and the '
+                        'evolution factors')
+    parser.add_argument('--record', metavar='DIRECTORY',
+                        help='stream |psi(x)|, |psi(k)| and t of every frame '
+                        'to memory-mapped .npy files in this directory')
+    parser.add_argument('--monitor-every', type=int, metavar='STEPS',
+                        help='sample the norm, <H> and the reflected and '
+                        'transmitted probabilities every STEPS steps')
+    parser.add_argument('--scheme', default='strang', choices=sorted(SCHEMES),
+                        help='splitting scheme of a step')
+    parser.add_argument('--tolerance', type=float,
+                        help='choose the steps by step doubling, keeping the '
+                        'error of each below this; --dt is then only the '
+                        'first step tried')
+    parser.add_argument('--absorbing-width', type=float,
+                        help='line both ends of the grid with absorbing '
+                        'layers this wide instead of hard walls')
+    parser.add_argument('--absorbing-strength', type=float, default=5.0,
+                        help='height of the absorbing potential at the '
+                        'edges of the grid')
+    parser.add_argument('--engine', default='split-step',
+                        choices=['split-step', 'crank-nicolson'],
+                        help='propagator; crank-nicolson has Dirichlet '
+                        'boundaries and no fft (see crank_nicolson.py)')
+    parser.add_argument('--export', metavar='VIDEO',
+                        help='after --record, render the recording to this '
+                        'video (or PNG files, without ffmpeg) on a process '
+                        'pool; see export.py')
+    parser.add_argument('--export-workers', type=int,
+                        help='rendering processes for --export (default: '
+                        'one per CPU)')
+    args = batch.parse_arguments(parser, argv)
+    if args.export and not args.record:
+        parser.error('--export renders the recording of --record')
+    if args.export and sys.version_info < (3, 7):
+        parser.error('--export needs python 3.7 or later')
+    if args.engine == 'crank-nicolson' and (
+            args.monitor_every or args.tolerance or args.absorbing_width
+            or args.scheme != 'strang'):
+        parser.error('--monitor-every, --tolerance, --absorbing-width and '
+                     '--scheme need the split-step engine')
+
+    frames = int(args.t_max / float(args.steps_per_frame * args.dt))
+    if args.record or args.headless or args.output:
+        S, x0, p0 = barrier_simulation(args.points, args.dx,
+                                       args.barrier_height, args.hbar,
+                                       args.mass, args.fft_workers,
+                                       args.dtype, args.scheme,
+                                       args.absorbing_width,
+                                       args.absorbing_strength)
+        if args.engine == 'crank-nicolson':
+            S = crank_nicolson.from_schrodinger(S)
+        if args.monitor_every:
+            S.monitor(args.monitor_every,
+                      barrier_regions(args.barrier_height, args.hbar,
+                                      args.mass))
+        if args.record and not args.output:
+            trajectory.record(S, args.record, args.dt,
+                              frames * args.steps_per_frame,
+                              args.steps_per_frame, tolerance=args.tolerance)
+        else:
+            # with --record and --output, the frames are recorded as the
+            # expectation values of --output are taken
+            recorder = None
+            if args.record:
+                recorder = trajectory.Recorder(args.record, S, frames)
+            try:
+                t, values = run_headless(S, args.dt, args.steps_per_frame,
+                                         frames, args.tolerance, recorder)
+            finally:
+                if recorder is not None:
+                    recorder.close()
+            print("norm drift at t = %g: %.3g"
+                  % (S.t, values['norm_drift'][-1]))
+        if args.record:
+            print("%d frames recorded in %s" % (frames, args.record))
+            if args.export:
+                # imported here, as the process pool and ffmpeg pipe of
+                # export need python 3
+                import export
+                path = export.export(args.record, args.export,
+                                     workers=args.export_workers, x0=x0,
+                                     p0=p0, V0=args.barrier_height,
+                                     hbar=args.hbar, m=args.mass)
+                print("frames written to %s" % path)
+        if S.absorber is not None:
+            print("absorbed %.6f by t = %g" % (S.absorbed(), S.t))
+        if S.diagnostics is not None:
+            samples = S.diagnostics.results()
+            print("reflected %.6f, transmitted %.6f, <H> %.6f at t = %g"
+                  % (samples['reflected'][-1], samples['transmitted'][-1],
+                     samples['H'][-1], samples['t'][-1]))
+            if S.absorber is not None:
+                print("absorbed left %.6f, right %.6f; transmission %.6f"
+                      % (samples['absorbed_left'][-1],
+                         samples['absorbed_right'][-1],
+                         samples['transmitted'][-1]
+                         + samples['absorbed_right'][-1]))
+        if args.output:
+            arrays = dict(('expectation_' + name, value)
+                          for name, value in values.items())
+            if S.diagnostics is not None:
+                arrays.update(('diagnostics_' + name, value)
+                              for name, value in samples.items())
+            batch.save_results(args.output, args, t=t, x=S.x, k=S.k,
+                               V_x=S.V_x, psi_x=S.psi_x, psi_k=S.psi_k,
+                               **arrays)
+    if not args.headless:
+        S, x0, p0 = barrier_simulation(args.points, args.dx,
+                                       args.barrier_height, args.hbar,
+                                       args.mass, args.fft_workers,
+                                       args.dtype, args.scheme,
+                                       args.absorbing_width,
+                                       args.absorbing_strength)
+        if args.engine == 'crank-nicolson':
+            S = crank_nicolson.from_schrodinger(S)
+        show_animation(S, args.dt, args.steps_per_frame, frames, x0, p0,
+                       args.barrier_height, args.tolerance)
 
-#anim.save('schrodinger_barrier.mp4', fps=15, extra_args=['-vcodec', 'libx264'])
 
-pl.show()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
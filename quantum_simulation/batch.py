@@ -0,0 +1,61 @@
+"""
+Helpers shared by the command line entry points of the simulators.
+
+Each simulator adds its own parameters to the parser from
+``argument_parser`` and hands it to ``parse_arguments``, which adds
+``--config`` so the same parameters can come from a JSON file.
+``save_results`` writes the arrays of a run, together with the parameters
+that produced them, to a compressed ``.npz`` file.
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+
+def argument_parser(description):
+    "returns a parser with the --headless and --output flags of every simulator"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--headless', action='store_true',
+                        help='do not import matplotlib or open any window')
+    parser.add_argument('--output', metavar='FILE.npz',
+                        help='write the results to this compressed npz file')
+    return parser
+
+
+def parse_arguments(parser, argv=None):
+    """
+    Parse argv, taking default values from the JSON file given by --config.
+
+    The keys of the JSON object are the option names with dashes replaced
+    by underscores, e.g. {"energy_interval": 0.1}.  Flags given on the
+    command line take precedence over the file.
+    """
+    parser.add_argument('--config', metavar='FILE.json',
+                        help='JSON file of parameter values')
+    args = parser.parse_args(argv)
+    if args.config:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+        unknown = sorted(set(config) - set(vars(args)))
+        if unknown:
+            parser.error("unknown keys in %s: %s"
+                         % (args.config, ', '.join(unknown)))
+        parser.set_defaults(**config)
+        args = parser.parse_args(argv)
+    return args
+
+
+def save_results(path, args, **arrays):
+    """
+    Write arrays and the parameters in args to a compressed npz file.
+
+    Every parameter is stored as a zero dimensional array named
+    ``parameter_<name>``; parameters that were not set are left out.
+    """
+    for name, value in sorted(vars(args).items()):
+        if value is not None and name not in ('config', 'output'):
+            arrays['parameter_' + name] = np.asarray(value)
+    np.savez_compressed(path, **arrays)
+
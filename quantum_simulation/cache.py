@@ -0,0 +1,187 @@
+"""
+Persistent on-disk cache of eigen values and eigen states.
+
+An entry is addressed by ``cache_key``, a hash of everything that decides
+the result of an eigen search: the potential (its name, parameters and the
+sampled array itself), the grid, the boundary values and the solver
+settings.  ``EigenCache`` keeps each entry as a pair of ``.npy`` files, so
+the eigen states of a repeated run are memory-mapped instead of computed
+again.  When the files grow past ``max_bytes`` the least recently used
+entries are removed.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# bump when the layout of the stored arrays, or how the scripts compute them,
+# changes so old entries miss
+CACHE_VERSION = 2
+CACHE_DIRECTORY = os.environ.get(
+    'PHY_CODE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'phy_code'))
+MAX_BYTES = 256 * 2 ** 20
+
+# os.replace is python 3; os.rename also replaces the target on POSIX
+_replace = getattr(os, 'replace', os.rename)
+
+
+def cache_key(**parts):
+    """
+    Return a hex digest identifying an eigen search.
+
+    Parameters
+    ----------
+    **parts :
+        numbers, strings, booleans, None, or numpy arrays.  Arrays are
+        hashed by dtype, shape and contents, so two potentials that sample
+        to the same values get the same key.
+    """
+    digest = hashlib.sha1()
+    digest.update(('version %d' % CACHE_VERSION).encode('ascii'))
+    for name in sorted(parts):
+        value = parts[name]
+        digest.update(name.encode('utf-8'))
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            digest.update(('%s %s' % (value.dtype.str, value.shape)).encode('ascii'))
+            digest.update(value.tobytes())
+        else:
+            digest.update(json.dumps(value).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EigenCache(object):
+    """
+    Size-bounded directory of eigen search results
+
+    Parameters
+    ----------
+    directory : string, optional
+        where the entries live.  If not specified, CACHE_DIRECTORY, which
+        can be set with the PHY_CODE_CACHE environment variable.
+    max_bytes : int, optional
+        total size the entries may take before the least recently used are
+        removed (default = MAX_BYTES)
+    """
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = CACHE_DIRECTORY
+        if max_bytes is None:
+            max_bytes = MAX_BYTES
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key, part):
+        return os.path.join(self.directory, '%s.%s.npy' % (key, part))
+
+    def entries(self):
+        """
+        Return (last_used, size, key) for every complete entry, least
+        recently used first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.values.npy'):
+                continue
+            key = name[:-len('.values.npy')]
+            try:
+                last_used = os.path.getmtime(self._path(key, 'values'))
+                size = (os.path.getsize(self._path(key, 'values'))
+                        + os.path.getsize(self._path(key, 'vectors')))
+            except OSError:
+                continue
+            entries.append((last_used, size, key))
+        entries.sort()
+        return entries
+
+    def load(self, key):
+        """
+        Return (eigen_values, eigen_vectors) stored under key, or None.
+
+        eigen_vectors is a read-only memory map of the stored array.
+        """
+        try:
+            eigen_vectors = np.load(self._path(key, 'vectors'), mmap_mode='r')
+            eigen_values = np.load(self._path(key, 'values'))
+            os.utime(self._path(key, 'values'), None)
+        except (IOError, OSError, ValueError):
+            return None
+        return eigen_values, eigen_vectors
+
+    def store(self, key, eigen_values, eigen_vectors):
+        "writes an entry and evicts old ones to stay within max_bytes"
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            # another process may have made it in the meantime
+            if not os.path.isdir(self.directory):
+                raise
+        # the values file marks an entry as complete, so it is written last
+        # and both files are renamed into place only once fully written.
+        # Every write has a file of its own, so processes storing the same
+        # key at once do not write into each other's files.
+        for part, array in (('vectors', eigen_vectors), ('values', eigen_values)):
+            descriptor, partial_path = tempfile.mkstemp(
+                suffix='.tmp', prefix=key + '.', dir=self.directory)
+            try:
+                with os.fdopen(descriptor, 'wb') as partial:
+                    np.save(partial, np.asarray(array))
+                _replace(partial_path, self._path(key, part))
+            except BaseException:
+                os.remove(partial_path)
+                raise
+        self.evict()
+
+    def invalidate(self, key=None):
+        "removes the entry stored under key, or every entry if key is None"
+        keys = [key] if key is not None else [entry[2] for entry in self.entries()]
+        for key in keys:
+            for part in ('values', 'vectors'):
+                try:
+                    os.remove(self._path(key, part))
+                except OSError:
+                    pass
+
+    def evict(self):
+        "removes least recently used entries until the total is within max_bytes"
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total -= size
+
+
+def add_arguments(parser):
+    "adds the flags that control the eigen cache to an argument parser"
+    parser.add_argument('--cache', action='store_true',
+                        help='load a search run before with the same settings from the eigen '
+                        'cache, and store a new one there (off by default)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='always run the eigen search, do not read or write the cache '
+                        '(the default)')
+    parser.add_argument('--cache-dir', default=CACHE_DIRECTORY,
+                        help='directory of the eigen cache (default: %(default)s)')
+    parser.add_argument('--cache-size', type=float, default=MAX_BYTES / 2.0 ** 20,
+                        help='megabytes the eigen cache may use (default: %(default)s)')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='remove every entry of the eigen cache before running')
+
+
+def open_cache(args):
+    "returns the EigenCache selected by the flags of add_arguments, or None"
+    "unless --cache is given; --clear-cache empties the cache either way"
+    if not (args.cache or args.clear_cache):
+        return None
+    eigen_cache = EigenCache(args.cache_dir, int(args.cache_size * 2 ** 20))
+    if args.clear_cache:
+        eigen_cache.invalidate()
+    if not args.cache:
+        return None
+    return eigen_cache
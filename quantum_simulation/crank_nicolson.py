@@ -0,0 +1,326 @@
+"""
+Crank-Nicolson solver for the 1D time-dependent Schrodinger equation.
+
+``animate.Schrodinger`` transforms with the fft, so its grid is periodic
+and anything leaving one end comes back at the other unless a wall or an
+absorber stops it.  ``CrankNicolson`` has the same interface but advances
+psi by
+
+    (1 + i dt H / 2 hbar) psi(t + dt) = (1 - i dt H / 2 hbar) psi(t)
+
+with the three point second difference for the kinetic term, so psi
+vanishes just beyond either end of the grid (Dirichlet boundaries).  The
+matrix on the left is tridiagonal: it is LU factorized once (LAPACK
+gttrf) and every step is one tridiagonal product and one pair of
+triangular solves (gttrs), O(N) work against the O(N log N) of the ffts.
+The factorization is only redone when dt or V_x changes.
+
+The step is unitary and unconditionally stable, second order in dt like
+the Strang splitting, but the second difference makes the dispersion of
+short waves wrong by about (k dx)^2 / 12.  ``benchmark`` times both
+solvers on the packet and barrier of ``animate.barrier_simulation``, and
+``python crank_nicolson.py`` prints which is faster at each grid size.
+"""
+
+from __future__ import print_function
+
+import time
+
+import numpy as np
+from scipy.fftpack import fft
+from scipy.linalg import get_lapack_funcs
+
+import batch
+import observables
+
+
+class CrankNicolson(object):
+    """
+    Crank-Nicolson solution of the time-dependent Schrodinger equation for
+    an arbitrary potential, with psi = 0 beyond the ends of the grid
+
+    Parameters
+    ----------
+    x : array_like, float
+        length-N array of evenly spaced spatial coordinates
+    psi_x0 : array_like, complex
+        length-N array of the initial wave function at time t0, or an
+        array of shape (..., N) holding an ensemble of wave functions that
+        are evolved together
+    V_x : array_like, float
+        length-N array giving the potential at each x, shared by every
+        member of an ensemble
+    k0 : float
+        the minimum value of k of psi_k, as in ``animate.Schrodinger``
+    hbar : float
+        value of planck's constant (default = 1)
+    m : float
+        particle mass (default = 1)
+    t0 : float
+        initial time (default = 0)
+    dtype : numpy dtype, optional
+        complex type of the wave function and of the factorization
+        (default = complex128)
+    """
+    def __init__(self, x, psi_x0, V_x, k0=None, hbar=1, m=1, t0=0.0,
+                 dtype=complex):
+        self.x, psi_x0 = map(np.asarray, (x, psi_x0))
+        N = self.x.size
+        assert self.x.shape == (N,)
+        assert psi_x0.shape[-1:] == (N,)
+
+        self.hbar = hbar
+        self.m = m
+        self.t = t0
+        self.N = N
+        self.dx = self.x[1] - self.x[0]
+        self.dk = 2 * np.pi / (self.N * self.dx)
+        if k0 is None:
+            self.k0 = -0.5 * self.N * self.dk
+        else:
+            self.k0 = k0
+        self.k = self.k0 + self.dk * np.arange(self.N)
+        self.dtype = np.dtype(dtype)
+        assert self.dtype.kind == 'c'
+        self._gttrf, self._gttrs = get_lapack_funcs(('gttrf', 'gttrs'),
+                                                    dtype=self.dtype)
+
+        # the wave functions are the rows of one array, so that its
+        # transpose is the column major right hand side gttrs works on in
+        # place; each step writes into the other array and swaps
+        self._shape = psi_x0.shape
+        rows = int(np.prod(self._shape[:-1]))
+        self._psi = np.zeros((rows, N), dtype=self.dtype)
+        self._rhs = np.zeros((rows, N), dtype=self.dtype)
+        self._norm_reference = None
+
+        self.dt_ = None
+        self._factors = None
+        self.V_x = V_x
+        self.psi_x = psi_x0
+
+        # steps taken so far; there are no diagnostics or absorber, but the
+        # attributes are there for code written for Schrodinger
+        self.steps = 0
+        self.diagnostics = None
+        self.absorber = None
+
+        # attributes used for dynamic plotting
+        self.psi_x_line = None
+        self.psi_k_line = None
+        self.V_x_line = None
+
+    def _get_psi_x(self):
+        return self._psi.reshape(self._shape).copy()
+
+    def _set_psi_x(self, psi_x):
+        self._psi[...] = np.reshape(psi_x, (-1, self.N))
+        self._norm_reference = None
+
+    def _get_psi_k(self):
+        phase = np.exp(-1j * self.k0 * self.x)
+        psi_k = fft(self._psi * phase, axis=-1) * (self.dx / np.sqrt(2 * np.pi))
+        psi_k *= np.exp(-1j * self.x[0] * self.dk * np.arange(self.N))
+        return psi_k.reshape(self._shape)
+
+    def _get_V_x(self):
+        return self._V_x
+
+    def _set_V_x(self, V_x):
+        V_x = np.asarray(V_x, dtype=float)
+        assert V_x.shape == (self.N,)
+        self._V_x = V_x
+        self._factors = None
+
+    def _get_dt(self):
+        return self.dt_
+
+    def _set_dt(self, dt):
+        if dt != self.dt_:
+            self.dt_ = dt
+            self._factors = None
+
+    psi_x = property(_get_psi_x, _set_psi_x)
+    psi_k = property(_get_psi_k)
+    V_x = property(_get_V_x, _set_V_x)
+    dt = property(_get_dt, _set_dt)
+
+    def _factorize(self):
+        """
+        LU factorize 1 + i dt H / 2 hbar and keep it, along with the
+        diagonal and off diagonal of 1 - i dt H / 2 hbar
+        """
+        kinetic = 0.5 * self.hbar * self.hbar / (self.m * self.dx * self.dx)
+        r = 0.5j * self.dt_ / self.hbar
+        diagonal = 2 * kinetic + self._V_x
+        off_diagonal = np.empty(self.N - 1, dtype=self.dtype)
+        off_diagonal.fill(-r * kinetic)
+        dl, d, du, du2, ipiv, info = self._gttrf(
+            off_diagonal, (1 + r * diagonal).astype(self.dtype),
+            off_diagonal.copy())
+        if info != 0:
+            raise ValueError("Crank-Nicolson matrix is singular (info = %d)"
+                             % info)
+        self._factors = (dl, d, du, du2, ipiv,
+                         (1 - r * diagonal).astype(self.dtype),
+                         self.dtype.type(r * kinetic))
+
+    def abs_psi_x(self, out=None):
+        "return |psi(x)|, written into out if it is given"
+        return np.abs(self._psi.reshape(self._shape), out=out)
+
+    def abs_psi_k(self, out=None):
+        "return |psi(k)|, written into out if it is given"
+        return np.abs(self.psi_k, out=out)
+
+    def norm(self):
+        """
+        Return sum(|psi(x)|^2) dx, accumulated in double precision; for an
+        ensemble, one value per member.
+        """
+        density = self.abs_psi_x()
+        density *= density
+        return np.sum(density, axis=-1, dtype=float) * self.dx
+
+    def norm_drift(self):
+        """
+        Return norm() / norm_0 - 1, where norm_0 is the norm when time_step
+        first ran after the wave function was last set (see
+        ``animate.Schrodinger.norm_drift``).
+        """
+        if self._norm_reference is None:
+            return np.zeros(self._shape[:-1])
+        return self.norm() / self._norm_reference - 1
+
+    def expectation_values(self):
+        """
+        Return the expectation values of the current wave function.
+
+        See ``observables.expectation_values`` for the keys of the
+        returned dict.
+        """
+        return observables.expectation_values(self.psi_x, self.dx, self.x,
+                                              self.V_x, self.hbar, self.m)
+
+    def time_step(self, dt, Nsteps=1):
+        """
+        Perform Nsteps Crank-Nicolson steps of dt, factorizing first if dt
+        or V_x changed since the last call.
+        """
+        self.dt = dt
+        if self._factors is None:
+            self._factorize()
+        if self._norm_reference is None:
+            self._norm_reference = self.norm()
+        dl, d, du, du2, ipiv, diagonal, off_diagonal = self._factors
+        gttrs = self._gttrs
+
+        psi = self._psi
+        rhs = self._rhs
+        for i in range(Nsteps):
+            # rhs = (1 - i dt H / 2 hbar) psi, then solved for in place
+            np.multiply(psi, diagonal, out=rhs)
+            rhs[:, 1:] += off_diagonal * psi[:, :-1]
+            rhs[:, :-1] += off_diagonal * psi[:, 1:]
+            solution, info = gttrs(dl, d, du, du2, ipiv, rhs.T, overwrite_b=1)
+            if not np.may_share_memory(solution, rhs):
+                rhs.T[...] = solution
+            psi, rhs = rhs, psi
+        self._psi = psi
+        self._rhs = rhs
+
+        self.t += dt * Nsteps
+        self.steps += Nsteps
+
+    def run(self, dt, n_steps, every=1, tolerance=None):
+        """
+        Generator advancing the wave function by n_steps steps of dt, which
+        yields this object after every `every` steps, and after the last
+        step (see ``animate.Schrodinger.run``).  There is no adaptive
+        stepping, so tolerance must be None.
+        """
+        if tolerance is not None:
+            raise ValueError("Crank-Nicolson steps are not adaptive")
+        done = 0
+        while done < n_steps:
+            steps = min(every, n_steps - done)
+            self.time_step(dt, steps)
+            done += steps
+            yield self
+
+
+def from_schrodinger(S, dtype=None):
+    """
+    Return a CrankNicolson object with the grid, wave function, potential
+    and constants of the Schrodinger object S.  An absorber of S is
+    dropped: the boundaries are Dirichlet instead.
+    """
+    if dtype is None:
+        dtype = S.dtype
+    return CrankNicolson(S.x, S.psi_x, S.V_x, k0=S.k0, hbar=S.hbar, m=S.m,
+                         t0=S.t, dtype=dtype)
+
+
+def _time_per_step(S, dt, steps):
+    "returns the seconds per step of S.time_step(dt), after one warm up step"
+    S.time_step(dt)
+    start = time.time()
+    S.time_step(dt, steps)
+    return (time.time() - start) / steps
+
+
+def benchmark(points=(256, 1024, 4096, 16384, 65536), dx=0.1, dt=0.01,
+              steps=200, workers=None, dtype=complex):
+    """
+    Time a step of the split-step and the Crank-Nicolson solver on the
+    packet and barrier of ``animate.barrier_simulation`` for every number
+    of grid points.
+
+    Returns a dict of arrays of seconds per step, keyed 'split-step' and
+    'crank-nicolson', one value per element of points.
+    """
+    # imported here, as animate uses this module for its --engine option
+    import animate
+
+    times = {'split-step': [], 'crank-nicolson': []}
+    for N in points:
+        S, x0, p0 = animate.barrier_simulation(N, dx, workers=workers,
+                                               dtype=dtype)
+        C = from_schrodinger(S)
+        times['split-step'].append(_time_per_step(S, dt, steps))
+        times['crank-nicolson'].append(_time_per_step(C, dt, steps))
+    return dict((name, np.array(value)) for name, value in times.items())
+
+
+def main(argv=None):
+    "prints the time per step of both solvers for a few grid sizes"
+    parser = batch.argument_parser(
+        'Time the split-step and Crank-Nicolson solvers against each other.')
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[256, 1024, 4096, 16384, 65536],
+                        help='numbers of grid points to time')
+    parser.add_argument('--dx', type=float, default=0.1)
+    parser.add_argument('--dt', type=float, default=0.01)
+    parser.add_argument('--steps', type=int, default=200,
+                        help='steps timed per solver and size')
+    parser.add_argument('--fft-workers', type=int,
+                        help='threads per fft, -1 for one per CPU')
+    parser.add_argument('--dtype', default='complex128',
+                        choices=['complex128', 'complex64'])
+    args = batch.parse_arguments(parser, argv)
+
+    times = benchmark(args.points, args.dx, args.dt, args.steps,
+                      args.fft_workers, args.dtype)
+    print("points, split-step us, crank-nicolson us, faster")
+    for N, split, crank in zip(args.points, times['split-step'],
+                               times['crank-nicolson']):
+        print(N, '%.1f' % (1e6 * split), '%.1f' % (1e6 * crank),
+              'split-step' if split < crank else 'crank-nicolson')
+    if args.output:
+        batch.save_results(args.output, args, points=np.array(args.points),
+                           split_step=times['split-step'],
+                           crank_nicolson=times['crank-nicolson'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Diagnostics accumulated inside the split-step loop of ``Schrodinger``.
+
+Reading ``psi_x`` after a frame costs a complex multiply by the phase
+factors and, for anything kinetic, an extra fft.  ``Diagnostics`` instead
+looks at the buffer ``time_step`` is already transforming, at the three
+points of a step where it holds something useful:
+
+* before the forward fft the x buffer holds psi(t_n) times a phase of
+  modulus one, which gives <V> at t_n;
+* after the kinetic factor the k buffer holds psi(k) of psi(t_n) kicked by
+  half a step of the potential, which gives <T> at t_n + dt / 2, just
+  like the half step momentum of the leapfrog method;
+* after the inverse fft the x buffer holds psi(t_n + dt), again up to a
+  phase, which gives the norm, <V> and the probability in every region.
+
+<H> is <T> at the half step plus the mean of <V> at both ends, which is
+second order accurate in dt like the splitting itself.  Each quantity is a
+single matrix product of |psi|^2 with a stack of weights, and nothing is
+done at steps that are not sampled.
+
+With an absorber, 'absorbed_left' and 'absorbed_right' split the
+probability lost since the diagnostics were attached, which is exact,
+between the two layers in proportion to the integrals over time (by the
+trapezoidal rule over the samples) of the rate 2 / hbar * <W> at which
+each takes probability.  The split only needs samples that are close
+compared to the time a packet spends in a layer.
+"""
+
+import numpy as np
+
+NAMES = ('t', 'norm', 'V', 'T', 'H')
+
+
+class Diagnostics(object):
+    """
+    Samples of norm, <V>, <T>, <H> and region probabilities, taken every
+    `every` steps of a Schrodinger object
+
+    Parameters
+    ----------
+    S : Schrodinger
+        the solver to watch.  Use ``Schrodinger.monitor`` to attach.
+    every : int
+        steps between samples (default = 1).  Steps are counted across calls
+        of time_step, so the cadence does not depend on how a run is split.
+    regions : dict, optional
+        name -> (x_min, x_max) of the regions whose probability is recorded,
+        e.g. {'transmitted': (a, np.inf)}.  On a grid of several dimensions
+        a region is a boolean mask of the grid instead.
+
+    The samples are in ``values``, a dict of lists keyed by the names in
+    ``NAMES`` and the region names; ``results`` returns them as arrays.
+    """
+    def __init__(self, S, every=1, regions=None):
+        self.every = every
+        self.regions = sorted(regions) if regions else []
+        if set(self.regions) & set(NAMES):
+            raise ValueError("region names may not be any of %s"
+                             % ', '.join(NAMES))
+        self.values = dict((name, []) for name in NAMES + tuple(self.regions))
+
+        if isinstance(S.x, list):
+            k2 = sum(np.meshgrid(*[k * k for k in S.k], indexing='ij'))
+            self._grid_shape = S.shape
+        else:
+            k2 = S.k * S.k
+            self._grid_shape = S.x.shape
+        dx = np.asarray(S.dx, dtype=float)
+        # |psi(x)|^2 dV is |psi_mod_x|^2 times this
+        self._cell = np.prod(dx) * np.prod(2 * np.pi / (dx * dx))
+
+        # one weight per row: 1 for the norm, V if it is shared by the whole
+        # ensemble, then one row per region
+        weights = [np.ones(self._grid_shape)]
+        V_x = np.asarray(S.V_x, dtype=float)
+        self._V_x = None
+        if V_x.shape == self._grid_shape:
+            weights.append(V_x)
+        else:
+            self._V_x = V_x
+        for name in self.regions:
+            region = regions[name]
+            if isinstance(region, tuple):
+                x_min, x_max = region
+                region = (S.x >= x_min) & (S.x < x_max)
+            weights.append(np.asarray(region, dtype=float))
+        self.layers = ['absorbed_' + name for name, _ in S._layers]
+        for name, layer in S._layers:
+            rate = np.zeros(self._grid_shape)
+            rate[layer] = 2 / S.hbar * S.absorber[layer]
+            weights.append(rate)
+            self.values['absorbed_' + name] = []
+        self._weights = np.array(weights).reshape(len(weights), -1).T
+        self._kinetic = (0.5 * S.hbar * S.hbar / S.m * k2).reshape(-1)
+
+        shape = S.psi_mod_x.shape
+        self._density = np.zeros(shape, dtype=np.finfo(S.dtype).dtype)
+        self._V_before = None
+        if self.layers:
+            # integrated absorption rates so far, the rates at the last
+            # sample and the norm before any absorption
+            sums = self._reduce(S.psi_mod_x)
+            self._t_last = S.t
+            self._rates = sums[..., -len(self.layers):]
+            self._integrals = np.zeros(self._rates.shape)
+            self._norm_start = sums[..., 0]
+
+    def due(self, step):
+        "returns True if the step numbered step (counting from 0) is sampled"
+        return (step + 1) % self.every == 0
+
+    def _reduce(self, psi):
+        "returns |psi|^2 summed against every weight, in double precision"
+        density = np.abs(psi, out=self._density)
+        density *= density
+        flat = density.reshape(density.shape[:density.ndim - len(self._grid_shape)]
+                               + (-1,))
+        sums = np.dot(flat.astype(float, copy=False), self._weights)
+        if self._V_x is not None:
+            V = np.sum(density * self._V_x, axis=-1, dtype=float)
+            sums = np.concatenate([sums[..., :1], V[..., None], sums[..., 1:]],
+                                  axis=-1)
+        return sums
+
+    def before_step(self, psi_x):
+        "takes <V> at the start of a sampled step, from the x buffer"
+        sums = self._reduce(psi_x)
+        self._V_before = sums[..., 1] / sums[..., 0]
+
+    def kinetic(self, psi_k):
+        "takes <T> at the middle of a sampled step, from the k buffer"
+        density = np.abs(psi_k, out=self._density)
+        density *= density
+        flat = density.reshape(density.shape[:density.ndim - len(self._grid_shape)]
+                               + (-1,))
+        self._T = (np.dot(flat, self._kinetic)
+                   / np.sum(flat, axis=-1, dtype=float))
+
+    def after_step(self, psi_x, t):
+        "takes the rest at the end of a sampled step, from the x buffer"
+        sums = self._reduce(psi_x)
+        norm = sums[..., 0]
+        V = sums[..., 1] / norm
+        values = self.values
+        values['t'].append(t)
+        values['norm'].append(norm * self._cell)
+        values['V'].append(V)
+        values['T'].append(self._T)
+        values['H'].append(self._T + 0.5 * (self._V_before + V))
+        for i, name in enumerate(self.regions):
+            values[name].append(sums[..., 2 + i] * self._cell)
+        if self.layers:
+            rates = sums[..., -len(self.layers):]
+            self._integrals += 0.5 * (self._rates + rates) * (t - self._t_last)
+            self._rates = rates
+            self._t_last = t
+            total = self._integrals.sum(axis=-1)
+            share = self._integrals / np.where(total > 0, total, 1)[..., None]
+            lost = (self._norm_start - norm) * self._cell
+            for i, name in enumerate(self.layers):
+                values[name].append(lost * share[..., i])
+
+    def results(self):
+        """
+        Return the samples as a dict of arrays of shape (samples,) plus the
+        ensemble shape, if any
+        """
+        return dict((name, np.array(value))
+                    for name, value in self.values.items())
@@ -0,0 +1,82 @@
+"""
+Finite difference eigensolver for the one-dimensional Schrodinger equation.
+
+On a uniform grid the three point second difference turns
+
+    psi''(x) = scale * (V(x) - E) * psi(x)
+
+into a symmetric tridiagonal eigenvalue problem.  The Euler step in the
+shooting scripts integrates the same three point recurrence, so one call
+to a tridiagonal eigensolver replaces a whole shooting sweep and returns
+the wave functions along with the eigenvalues.  psi is pinned to zero on
+the first and last grid points, which is where the eigenvalues can differ
+slightly from a shooting sweep that tests psi one step further out.
+"""
+
+import numpy as np
+from scipy.linalg import eigh_tridiagonal
+
+
+def solve(potential, dx, scale=1.0, count=None, lower_limit=None,
+          upper_limit=None):
+    """
+    Return eigenvalues and normalized wave functions of the grid Hamiltonian.
+
+    Parameters
+    ----------
+    potential : array_like, float
+        length-N array giving the potential at each grid point
+    dx : float
+        grid spacing
+    scale : float
+        factor multiplying (V - E) in the equation (default = 1)
+    count : int, optional
+        return the lowest ``count`` eigenpairs; none for a count of 0
+    lower_limit, upper_limit : float, optional
+        return the eigenpairs with lower_limit < E <= upper_limit.  If
+        neither ``count`` nor the limits are given, every eigenpair is
+        returned.
+
+    Returns
+    -------
+    eigen_values : ndarray, float
+        length-k array of eigenvalues in increasing order
+    eigen_vectors : ndarray, float
+        (k, N) array of wave functions normalized so that
+        sum(psi ** 2) * dx = 1, with the first interior point positive
+    """
+    potential = np.asarray(potential, dtype=float)
+    N = potential.size
+    assert potential.shape == (N,)
+
+    kinetic = 1.0 / (scale * dx * dx)
+    diagonal = 2 * kinetic + potential[1:-1]
+    off_diagonal = np.empty(N - 3)
+    off_diagonal.fill(-kinetic)
+
+    if count is not None and count < 0:
+        raise ValueError("count must be at least 0, not %d" % count)
+    if count == 0:
+        return np.zeros(0), np.zeros((0, N))
+    if count is not None:
+        eigen_values, vectors = eigh_tridiagonal(
+            diagonal, off_diagonal, select='i',
+            select_range=(0, min(count, N - 2) - 1))
+    elif lower_limit is not None or upper_limit is not None:
+        if lower_limit is None:
+            lower_limit = -np.inf
+        if upper_limit is None:
+            upper_limit = np.inf
+        eigen_values, vectors = eigh_tridiagonal(
+            diagonal, off_diagonal, select='v',
+            select_range=(lower_limit, upper_limit))
+    else:
+        eigen_values, vectors = eigh_tridiagonal(diagonal, off_diagonal)
+
+    eigen_vectors = np.zeros((len(eigen_values), N))
+    eigen_vectors[:, 1:-1] = vectors.T
+    signs = np.sign(eigen_vectors[:, 1])
+    signs[signs == 0] = 1
+    eigen_vectors *= signs[:, None]
+    eigen_vectors /= np.sqrt(np.sum(eigen_vectors ** 2, axis=1) * dx)[:, None]
+    return eigen_values, eigen_vectors
@@ -0,0 +1,283 @@
+"""
+Offscreen rendering of recorded runs to video.
+
+``animate.show_animation`` advances the solver and redraws the whole
+figure for every frame on the GUI thread.  ``export`` instead renders the
+snapshots of a recording (see ``trajectory``) without running the solver
+again: the frames are cut into chunks that are drawn on a process pool,
+each worker holding one Agg figure whose static parts are drawn once and
+restored for every frame, with only the lines and the title drawn on top.
+The frames are piped in order to ffmpeg as raw RGBA, or, if ffmpeg cannot
+be found, written by the workers themselves as a numbered PNG sequence.
+
+    python export.py DIRECTORY run.mp4 --workers 8
+"""
+
+from __future__ import print_function
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+import batch
+import trajectory
+
+# chunks of frames queued per worker ahead of the encoder, which bounds
+# how many rendered frames wait in memory
+CHUNKS_AHEAD = 2
+
+# recording, figure and artists of a worker process, set by _attach
+_worker = {}
+
+
+def _attach(directory, options):
+    "pool initializer: maps the recording and draws the static figure"
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    _worker.clear()
+    recording = trajectory.load(directory)
+    _worker['recording'] = recording
+    _worker['options'] = options
+    x = recording['x']
+    k = recording['k']
+    V_x = recording['V_x']
+    V0 = options['V0']
+    if V0 is None:
+        # scale the plot to the packet instead
+        scale = 4 * np.max(recording['abs_psi_x'][0])
+    else:
+        scale = V0
+    m = options['m']
+
+    # the figure of show_animation
+    fig = Figure(figsize=options['figsize'], dpi=options['dpi'])
+    canvas = FigureCanvasAgg(fig)
+    ax1 = fig.add_subplot(211, xlim=options['xlim'],
+                          ylim=(-0.2 * scale, 1.2 * scale))
+    psi_x_line, = ax1.plot([], [], c='r', label=r'$|\psi(x)|$',
+                           animated=True)
+    ax1.plot(x, V_x, c='k', label=r'$V(x)$')
+    center_line = ax1.axvline(0, c='k', ls=':', label=r"$x_0 + v_0t$",
+                              animated=True)
+    title = ax1.set_title("", animated=True)
+    ax1.legend(prop=dict(size=12))
+    ax1.set_xlabel('$x$')
+    ax1.set_ylabel(r'$|\psi(x)|$')
+
+    abs_psi_k = recording['abs_psi_k']
+    ymin = np.min(abs_psi_k[0])
+    ymax = np.max(abs_psi_k[0])
+    ax2 = fig.add_subplot(212, xlim=options['klim'],
+                          ylim=(ymin - 0.2 * (ymax - ymin),
+                                ymax + 0.2 * (ymax - ymin)))
+    psi_k_line, = ax2.plot([], [], c='r', label=r'$|\psi(k)|$', animated=True)
+    p0 = options['p0']
+    if p0 is not None:
+        ax2.axvline(-p0 / options['hbar'], c='k', ls=':', label=r'$\pm p_0$')
+        ax2.axvline(p0 / options['hbar'], c='k', ls=':')
+    if V0 is not None:
+        ax2.axvline(np.sqrt(2 * V0) / options['hbar'], c='k', ls='--',
+                    label=r'$\sqrt{2mV_0}$')
+    ax2.legend(prop=dict(size=12))
+    ax2.set_xlabel('$k$')
+    ax2.set_ylabel(r'$|\psi(k)|$')
+
+    canvas.draw()
+    _worker['background'] = canvas.copy_from_bbox(fig.bbox)
+    _worker['canvas'] = canvas
+    _worker['artists'] = (
+        (ax1, psi_x_line), (ax1, center_line), (ax2, psi_k_line),
+        (ax1, title))
+    _worker['abs_psi_x'] = np.zeros(x.shape)
+
+    if options['x0'] is None or p0 is None:
+        center_line.set_visible(False)
+    else:
+        _worker['center'] = (options['x0'], p0 / m)
+
+
+def _draw(frame):
+    "draws one frame of the recording onto the background of the figure"
+    recording = _worker['recording']
+    canvas = _worker['canvas']
+    (_, psi_x_line), (_, center_line), (_, psi_k_line), (_, title) = \
+        _worker['artists']
+    t = recording['t'][frame]
+
+    abs_psi_x = _worker['abs_psi_x']
+    np.multiply(recording['abs_psi_x'][frame], 4, out=abs_psi_x)
+    psi_x_line.set_data(recording['x'], abs_psi_x)
+    psi_k_line.set_data(recording['k'], recording['abs_psi_k'][frame])
+    if 'center' in _worker:
+        x0, v0 = _worker['center']
+        center_line.set_xdata(2 * [x0 + t * v0])
+    title.set_text("t = %.2f" % t)
+
+    canvas.restore_region(_worker['background'])
+    for ax, artist in _worker['artists']:
+        ax.draw_artist(artist)
+
+
+def _render_chunk(start, stop, pattern=None):
+    """
+    Draws frames start to stop - 1.  Returns their RGBA bytes, or writes
+    each to pattern % frame as a PNG and returns nothing.
+    """
+    from matplotlib.image import imsave
+
+    canvas = _worker['canvas']
+    frames = []
+    for frame in range(start, stop):
+        _draw(frame)
+        if pattern is None:
+            frames.append(bytes(canvas.buffer_rgba()))
+        else:
+            # print_png would draw the figure again, without the animated
+            # artists, so the buffer itself is saved
+            imsave(pattern % frame, np.asarray(canvas.buffer_rgba()))
+    return frames
+
+
+def _chunk_bounds(frames, workers, chunk_size):
+    "returns the start and stop frame of every chunk"
+    if chunk_size is None:
+        chunk_size = max(1, min(16, -(-frames // (4 * workers))))
+    starts = list(range(0, frames, chunk_size))
+    return starts, [min(start + chunk_size, frames) for start in starts]
+
+
+def export(directory, path, fps=15, workers=None, x0=None, p0=None, V0=None,
+           hbar=1.0, m=1.0, xlim=(-100, 100), klim=(-5, 5), figsize=(8, 6),
+           dpi=100, ffmpeg='ffmpeg', extra_args=(), chunk_size=None):
+    """
+    Render every frame of the recording in directory and encode them.
+
+    Parameters
+    ----------
+    directory : string
+        recording written by ``trajectory.record`` for a 1D grid
+    path : string
+        video file written by ffmpeg.  Without ffmpeg, the frames go to
+        the directory of that name with _frames in place of its extension,
+        as frame_00000.png, frame_00001.png, ...; a ValueError is raised if
+        that is the recording directory itself.
+    fps : float
+        frames per second of the video (default = 15)
+    workers : int, optional
+        number of rendering processes.  If not specified, one per CPU.
+    x0, p0 : float, optional
+        initial center and momentum of the packet, which place the moving
+        center line and the +-p0 lines of ``animate.show_animation``; left
+        out if not given
+    V0 : float, optional
+        height of the barrier, which sets the scale of the upper plot and
+        places the sqrt(2 m V0) line.  If not specified, the plot is scaled
+        to the first frame of the packet.
+    hbar, m : float
+        constants of the run (default = 1)
+    xlim, klim : tuple of float
+        limits of the x and k axes
+    figsize, dpi :
+        size of the figure in inches and dots per inch.  libx264 needs
+        both dimensions in pixels to be even.
+    ffmpeg : string or None
+        ffmpeg executable; None always writes PNG files
+    extra_args : sequence of string
+        passed to ffmpeg before the output file, e.g. ['-vcodec', 'libx264']
+    chunk_size : int, optional
+        frames per task.  If not specified, up to 16, small enough to give
+        every worker four tasks.
+
+    Returns
+    -------
+    path : string
+        the video file or the directory of PNG files written
+    """
+    frames = len(trajectory.load(directory)['t'])
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    options = dict(x0=x0, p0=p0, V0=V0, hbar=hbar, m=m, xlim=xlim, klim=klim,
+                   figsize=figsize, dpi=dpi)
+    starts, stops = _chunk_bounds(frames, workers, chunk_size)
+    encoder = shutil.which(ffmpeg) if ffmpeg else None
+    if encoder is None:
+        path = os.path.splitext(path)[0] + '_frames'
+        if os.path.realpath(path) == os.path.realpath(directory):
+            raise ValueError("PNG frames would be written into the recording %s"
+                             % directory)
+
+    # spawned, not forked, workers: a forked one would hold on to the pipe
+    # into ffmpeg, which then never sees the end of its input
+    with ProcessPoolExecutor(workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_attach,
+                             initargs=(directory, options)) as executor:
+        if encoder is None:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            pattern = os.path.join(path, 'frame_%05d.png')
+            list(executor.map(_render_chunk, starts, stops,
+                              [pattern] * len(starts)))
+            return path
+
+        width, height = int(figsize[0] * dpi), int(figsize[1] * dpi)
+        command = ([encoder, '-y', '-loglevel', 'error',
+                    '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                    '-s', '%dx%d' % (width, height), '-r', str(fps),
+                    '-i', '-', '-pix_fmt', 'yuv420p']
+                   + list(extra_args) + [path])
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        try:
+            # keep a few chunks per worker in flight and hand the finished
+            # ones to the encoder in order
+            chunks = list(zip(starts, stops))[::-1]
+            pending = deque()
+            while chunks or pending:
+                while chunks and len(pending) < CHUNKS_AHEAD * workers:
+                    pending.append(executor.submit(_render_chunk,
+                                                   *chunks.pop()))
+                for frame in pending.popleft().result():
+                    process.stdin.write(frame)
+        finally:
+            process.stdin.close()
+            status = process.wait()
+        if status != 0:
+            raise RuntimeError("%s exited with status %d" % (encoder, status))
+    return path
+
+
+def main(argv=None):
+    "exports a recording to a video or a PNG sequence"
+    parser = argparse.ArgumentParser(
+        description='Render a recorded run to a video.')
+    parser.add_argument('directory', help='recording made with --record')
+    parser.add_argument('video', help='video file to write, e.g. run.mp4')
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--workers', type=int,
+                        help='rendering processes (default: one per CPU)')
+    parser.add_argument('--x0', type=float,
+                        help='initial center of the packet')
+    parser.add_argument('--p0', type=float,
+                        help='initial momentum of the packet')
+    parser.add_argument('--barrier-height', type=float,
+                        help='height of the potential shown')
+    parser.add_argument('--hbar', type=float, default=1.0)
+    parser.add_argument('--mass', type=float, default=1.0)
+    parser.add_argument('--ffmpeg', default='ffmpeg',
+                        help='ffmpeg executable')
+    args = batch.parse_arguments(parser, argv)
+    path = export(args.directory, args.video, args.fps, args.workers,
+                  args.x0, args.p0, args.barrier_height, args.hbar, args.mass,
+                  ffmpeg=args.ffmpeg)
+    print("frames of %s written to %s" % (args.directory, path))
+
+
+if __name__ == '__main__':
+    main()
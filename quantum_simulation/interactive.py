@@ -0,0 +1,176 @@
+"""
+Helpers that keep the energy sliders of the shooting scripts responsive.
+
+``PsiCache`` remembers the wave functions of recently shown energies in a
+bounded least recently used cache keyed by the energy rounded to a fixed
+resolution, and can compute the neighbouring energies in a background
+thread while the user looks at the current one.  ``CoalescedCallback``
+wraps a slider callback so that a burst of slider events results in one
+update for the latest value.  ``psi_ticks`` picks y ticks for a wave
+function without going through the whole array in Python.
+"""
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+MAX_TICKS = 20
+
+
+class PsiCache(object):
+    """
+    Bounded LRU cache of wave functions keyed by quantized energy
+
+    Parameters
+    ----------
+    compute : callable
+        compute(energy) returns the wave function at that energy.  It is
+        only called from the thread that calls ``get``.
+    resolution : float
+        energies closer than this share an entry (default = 1e-3)
+    size : int
+        number of wave functions kept (default = 128)
+    compute_batch : callable, optional
+        compute_batch(energies) returns the (M, N) array of wave functions
+        at M energies.  It is called from the prefetch thread, so it must
+        not touch shared state.  If not specified, nothing is prefetched.
+    prefetch : int
+        number of energies on each side of the last one shown that are
+        computed in the background (default = 4)
+    """
+    def __init__(self, compute, resolution=1e-3, size=128, compute_batch=None,
+                 prefetch=4):
+        self.compute = compute
+        self.resolution = resolution
+        self.size = size
+        self.compute_batch = compute_batch
+        self.prefetch = prefetch if compute_batch is not None else 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._wanted = threading.Condition(self._lock)
+        self._target = None
+        self._thread = None
+
+    def key(self, energy, exact=False):
+        "returns the energy stored for energy, snapped to the resolution unless exact"
+        if exact:
+            return float(energy)
+        return round(energy / self.resolution) * self.resolution
+
+    def _put(self, key, psi):
+        # called with the lock held
+        self._entries.pop(key, None)
+        self._entries[key] = psi
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def get(self, energy, exact=False):
+        """
+        Return (energy, psi) for the cache entry of energy, computing it if
+        needed.  The returned energy is the one psi was computed for.
+
+        With exact set, energy is used as is instead of being rounded to
+        the resolution, which is what eigen values need.
+        """
+        key = self.key(energy, exact)
+        with self._lock:
+            psi = self._entries.pop(key, None)
+            if psi is not None:
+                self._entries[key] = psi
+        if psi is None:
+            psi = np.array(self.compute(key))
+            psi.flags.writeable = False
+            with self._lock:
+                self._put(key, psi)
+        if self.prefetch:
+            self.prefetch_around(key)
+        return key, psi
+
+    def fill(self, energies, exact=False):
+        "computes and stores the wave functions of every energy in one batch"
+        keys = [self.key(energy, exact) for energy in energies]
+        with self._lock:
+            keys = [key for key in keys if key not in self._entries]
+        if not keys:
+            return
+        if self.compute_batch is not None:
+            psi = np.array(self.compute_batch(np.array(keys)))
+        else:
+            psi = np.array([self.compute(key) for key in keys])
+        psi.flags.writeable = False
+        with self._lock:
+            for key, row in zip(keys, psi):
+                self._put(key, row)
+
+    def prefetch_around(self, energy):
+        "asks the background thread for the neighbours of energy"
+        with self._lock:
+            self._target = energy
+            self._wanted.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._prefetch_loop)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._lock:
+                while self._target is None:
+                    self._wanted.wait()
+                # only the latest request matters, older ones are dropped
+                energy, self._target = self._target, None
+            offsets = np.arange(1, self.prefetch + 1) * self.resolution
+            neighbours = np.concatenate([energy + offsets, energy - offsets])
+            self.fill(neighbours[neighbours >= 0])
+
+
+class CoalescedCallback(object):
+    """
+    Slider callback that runs function for the latest value only
+
+    Every call records its value and starts a single shot timer of the
+    canvas if none is pending; when the timer fires function runs once with
+    the most recent value, so the events that arrived meanwhile cost
+    nothing.
+
+    Parameters
+    ----------
+    canvas : FigureCanvas
+        canvas whose event loop runs the timer
+    function : callable
+        function(value) doing the actual update
+    interval : int
+        milliseconds to wait for further events (default = 10)
+    """
+    def __init__(self, canvas, function, interval=10):
+        self.function = function
+        self.value = None
+        self.pending = False
+        self.timer = canvas.new_timer(interval=interval)
+        self.timer.single_shot = True
+        self.timer.add_callback(self._run)
+
+    def __call__(self, value):
+        self.value = value
+        if not self.pending:
+            self.pending = True
+            self.timer.start()
+
+    def _run(self):
+        self.pending = False
+        self.function(self.value)
+
+
+def psi_ticks(psi, max_ticks=MAX_TICKS):
+    """
+    Return y ticks spanning psi, a quarter of its range apart but at
+    most 1, and no more than max_ticks of them
+    """
+    bottom = np.min(psi)
+    top = np.max(psi)
+    spread = abs(top - bottom)
+    if not np.isfinite(spread) or spread == 0:
+        return np.array([bottom])
+    step = max(min(spread / 4, 1), spread / max_ticks)
+    return np.arange(bottom, top, step)
@@ -0,0 +1,230 @@
+"""
+Matching-point shooting for potentials symmetric about x = 0.
+
+Only the half grid x >= 0 is integrated.  For each trial energy the
+solution is marched outward from the centre, starting from an even or an
+odd state, up to the outermost classical turning point, and inward from
+the far edge, where psi = 0, down to the same point.  Neither march
+crosses a classically forbidden region in its growing direction, so
+nothing diverges and neither goes further than it has to.
+
+The two pieces are compared through their Casoratian (the discrete
+Wronskian) at the matching point, scaled to the sine of the angle between
+them.  Unlike the difference of logarithmic derivatives it has no poles,
+and it keeps its sign when the matching point moves, so its sign changes
+bracket the levels.  Even and odd states are marched together, giving the
+levels of both parities from a single sweep.
+
+The steps are those of the three point recurrence behind the 'euler'
+integrator of ``shooting`` and ``eigensolver``, with the start set by
+parity, so the levels are the ones ``eigensolver.solve`` finds on the full
+grid with psi = 0 at both ends.
+"""
+
+import numpy as np
+
+# starting values (psi at 0, psi' at 0) of even and odd states
+PARITIES = ((1.0, 0.0), (0.0, 1.0))
+# solutions are scaled down once they reach this size
+RESCALE = 1e100
+
+
+def mismatch(energies, potential, dx, parity, scale=1.0):
+    """
+    Return the scaled Casoratian of the outward and inward solutions.
+
+    Parameters
+    ----------
+    energies : array_like, float
+        trial energies
+    potential : array_like, float
+        length-N array of the potential at x = 0, dx, ..., (N - 1) dx
+    dx : float
+        grid spacing
+    parity : array_like, int
+        0 for even and 1 for odd states, broadcast against energies
+    scale : float
+        factor multiplying (V - E) in the equation (default = 1)
+
+    Returns
+    -------
+    mismatch : ndarray, float
+        values in [-1, 1] shaped like the broadcast of energies and parity,
+        zero exactly at the levels
+    """
+    energies, parity = np.broadcast_arrays(np.asarray(energies, dtype=float),
+                                           np.asarray(parity, dtype=int))
+    shape = energies.shape
+    energies = energies.ravel()
+    odd = parity.ravel() == 1
+    potential = np.asarray(potential, dtype=float)
+    N = potential.size
+    h2 = dx * dx * scale
+    match = _matching_points(energies, potential)
+
+    # outward from the centre: an even state has psi[-1] = psi[1] and an odd
+    # one psi[0] = 0, which fixes psi[1] through the recurrence
+    psi_previous = np.where(odd, 0.0, 1.0)
+    psi = np.where(odd, dx, 1.0 + 0.5 * h2 * (potential[0] - energies))
+    out_m, out_m1 = _march(psi_previous, psi, potential, energies, h2,
+                           range(1, match.max() + 1), match, 1)
+
+    # inward from the edge, where psi = 0
+    psi_previous = np.zeros(energies.shape)
+    psi = np.empty(energies.shape)
+    psi.fill(dx)
+    in_m1, in_m = _march(psi_previous, psi, potential, energies, h2,
+                         range(N - 2, match.min(), -1), match + 1, -1)
+
+    casoratian = out_m * in_m1 - out_m1 * in_m
+    size = np.hypot(out_m, out_m1) * np.hypot(in_m, in_m1)
+    return (casoratian / size).reshape(shape)
+
+
+def _matching_points(energies, potential):
+    "returns the outermost index where each energy is above the potential"
+    N = potential.size
+    allowed = potential[None, :] <= energies[:, None]
+    match = np.where(allowed.any(axis=1),
+                     N - 1 - np.argmax(allowed[:, ::-1], axis=1), 1)
+    return np.clip(match, 1, N - 3)
+
+
+def _march(psi_previous, psi, potential, energies, h2, indices, stop, step):
+    """
+    Run the recurrence over indices and return psi at stop and at stop + step
+    for every energy
+    """
+    at_stop = np.zeros(energies.shape)
+    after_stop = np.zeros(energies.shape)
+    for index in indices:
+        psi_next = 2 * psi - psi_previous + h2 * (potential[index] - energies) * psi
+        here = stop == index
+        at_stop[here] = psi[here]
+        after_stop[here] = psi_next[here]
+        big = np.abs(psi_next) > RESCALE
+        if big.any():
+            # a positive factor leaves the sign of the mismatch alone
+            factor = np.where(big, 1.0 / RESCALE, 1.0)
+            psi, psi_next = psi * factor, psi_next * factor
+            at_stop *= factor
+            after_stop *= factor
+        psi_previous, psi = psi, psi_next
+    return at_stop, after_stop
+
+
+def find_eigenvalues(energies, potential, dx, scale=1.0, tolerance=1e-6,
+                     sections=16):
+    """
+    Find the even and odd levels in a range of energies in one sweep.
+
+    Parameters
+    ----------
+    energies : array_like, float
+        increasing coarse grid of trial energies.  It only has to be fine
+        enough that no step holds two levels of the same parity.
+    potential, dx, scale :
+        as for ``mismatch``
+    tolerance : float
+        width below which a bracket is taken as converged (default = 1e-6)
+    sections : int
+        pieces a bracket is cut into per batched evaluation (default = 16)
+
+    Returns
+    -------
+    eigen_values : ndarray, float
+        sorted levels found in the range
+    parity : ndarray, int
+        0 for the even and 1 for the odd levels in eigen_values
+    """
+    energies = np.asarray(energies, dtype=float)
+    parities = np.arange(len(PARITIES))[:, None]
+    values = mismatch(energies[None, :], potential, dx, parities, scale)
+    changes = np.sign(values[:, 1:]) != np.sign(values[:, :-1])
+    parity, index = np.nonzero(changes)
+    lower, upper = energies[index], energies[index + 1]
+    lower_sign = np.sign(values[parity, index])
+
+    fractions = np.arange(1, sections) / float(sections)
+    while np.any(upper - lower > tolerance):
+        points = lower[:, None] + (upper - lower)[:, None] * fractions
+        signs = np.sign(mismatch(points, potential, dx, parity[:, None], scale))
+        # the first piece whose upper end has left the sign of the lower end
+        index = np.argmax(np.column_stack(
+            (signs != lower_sign[:, None], np.ones(len(points), dtype=bool))), axis=1)
+        points = np.column_stack((lower, points, upper))
+        rows = np.arange(len(points))
+        lower, upper = points[rows, index], points[rows, index + 1]
+
+    eigen_values = 0.5 * (lower + upper)
+    order = np.argsort(eigen_values)
+    return eigen_values[order], parity[order]
+
+
+def eigen_states(eigen_values, parity, potential, dx, scale=1.0):
+    """
+    Return the wave functions of levels found by ``find_eigenvalues``.
+
+    Each state is marched outward and inward with the recurrence and
+    starts of ``mismatch``, and the inward piece is scaled to join the
+    outward one at the matching point, so neither piece is carried into
+    the region where it grows.
+
+    Parameters
+    ----------
+    eigen_values, parity : array_like
+        levels and their parities, as returned by ``find_eigenvalues``
+    potential, dx, scale :
+        as for ``mismatch``
+
+    Returns
+    -------
+    states : ndarray, float
+        array of shape (len(eigen_values), N) of psi at x = 0, dx, ...,
+        (N - 1) dx.  The state continued to x < 0 by its parity has
+        sum(|psi|^2) dx = 1 over the full grid, and the outward piece
+        keeps its sign.
+    """
+    eigen_values = np.asarray(eigen_values, dtype=float)
+    odd = np.asarray(parity, dtype=int) == 1
+    potential = np.asarray(potential, dtype=float)
+    N = potential.size
+    h2 = dx * dx * scale
+    match = _matching_points(eigen_values, potential)
+    shift = h2 * (potential[None, :] - eigen_values[:, None])
+
+    outward = np.zeros((eigen_values.size, N))
+    outward[:, 0] = np.where(odd, 0.0, 1.0)
+    outward[:, 1] = np.where(odd, dx, 1.0 + 0.5 * shift[:, 0])
+    for index in range(1, match.max() + 1):
+        psi_next = (2 * outward[:, index] - outward[:, index - 1]
+                    + shift[:, index] * outward[:, index])
+        outward[:, index + 1] = np.where(index <= match, psi_next, 0.0)
+        _rescale_rows(outward, index + 1)
+
+    inward = np.zeros((eigen_values.size, N))
+    inward[:, N - 2] = dx
+    for index in range(N - 2, match.min(), -1):
+        psi_next = (2 * inward[:, index] - inward[:, index + 1]
+                    + shift[:, index] * inward[:, index])
+        inward[:, index - 1] = np.where(index > match, psi_next, 0.0)
+        _rescale_rows(inward, index - 1)
+
+    # least squares factor taking the inward piece onto the outward one at
+    # the two points both have
+    rows = np.arange(eigen_values.size)
+    out_m, out_m1 = outward[rows, match], outward[rows, match + 1]
+    in_m, in_m1 = inward[rows, match], inward[rows, match + 1]
+    factor = (out_m * in_m + out_m1 * in_m1) / (in_m * in_m + in_m1 * in_m1)
+    beyond = np.arange(N)[None, :] > match[:, None]
+    states = np.where(beyond, factor[:, None] * inward, outward)
+
+    norm = dx * (2 * np.sum(states * states, axis=1) - states[:, 0] ** 2)
+    return states / np.sqrt(norm)[:, None]
+
+
+def _rescale_rows(states, column):
+    "scales down the rows of states whose value in column has grown too big"
+    big = np.abs(states[:, column]) > RESCALE
+    if big.any():
+        states[big] /= RESCALE
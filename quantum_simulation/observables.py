@@ -0,0 +1,79 @@
+"""
+Expectation values of wave functions sampled on a uniform grid.
+
+``expectation_values`` works on a single wave function or on a stack of
+them (any leading shape, grid along the last axis), real or complex, so
+every eigenstate found by an eigen search can be handled in one call.
+"""
+
+import numpy as np
+
+NAMES = ('norm', 'x', 'x2', 'p', 'p2', 'V', 'H', 'uncertainty')
+
+
+def expectation_values(psi, dx, x=None, potential=None, hbar=1.0, m=1.0):
+    """
+    Compute norm, <x>, <x^2>, <p>, <p^2>, <V>, <H> and dx * dp in one pass.
+
+    Derivatives are central differences with psi taken as zero outside
+    the grid.  psi does not need to be normalized.
+
+    Parameters
+    ----------
+    psi : array_like, float or complex
+        wave functions, shape (..., N)
+    dx : float
+        grid spacing
+    x : array_like, float, optional
+        length-N array of positions.  If not specified, the grid starts at
+        0 and the position based values are relative to the first point.
+    potential : array_like, float, optional
+        length-N array giving the potential at each x.  If not specified,
+        <V> is zero and <H> is the kinetic energy alone.
+    hbar : float
+        value of planck's constant (default = 1)
+    m : float
+        particle mass (default = 1)
+
+    Returns
+    -------
+    values : dict
+        arrays of shape psi.shape[:-1] keyed by the names in ``NAMES``.
+        'norm' is sum(|psi|^2) * dx, 'uncertainty' is the product of the
+        spreads in x and p; the rest are expectation values.
+    """
+    psi = np.asarray(psi)
+    N = psi.shape[-1]
+    if x is None:
+        x = dx * np.arange(N)
+    x = np.asarray(x, dtype=float)
+
+    padded = np.zeros(psi.shape[:-1] + (N + 2,), dtype=psi.dtype)
+    padded[..., 1:-1] = psi
+    dpsi = (padded[..., 2:] - padded[..., :-2]) / (2 * dx)
+    d2psi = (padded[..., 2:] - 2 * psi + padded[..., :-2]) / (dx * dx)
+    conj_psi = np.conj(psi)
+    density = (conj_psi * psi).real
+
+    # one stacked reduction over the grid for every integrand
+    integrands = [density, density * x, density * x * x,
+                  (conj_psi * dpsi).imag, (conj_psi * d2psi).real]
+    if potential is not None:
+        integrands.append(density * np.asarray(potential, dtype=float))
+    sums = np.sum(integrands, axis=-1) * dx
+
+    norm = sums[0]
+    values = {'norm': norm,
+              'x': sums[1] / norm,
+              'x2': sums[2] / norm,
+              'p': hbar * sums[3] / norm,
+              'p2': -hbar * hbar * sums[4] / norm}
+    if potential is not None:
+        values['V'] = sums[5] / norm
+    else:
+        values['V'] = np.zeros_like(norm)
+    values['H'] = values['p2'] / (2 * m) + values['V']
+    spread_x = np.sqrt(np.maximum(values['x2'] - values['x'] ** 2, 0))
+    spread_p = np.sqrt(np.maximum(values['p2'] - values['p'] ** 2, 0))
+    values['uncertainty'] = spread_x * spread_p
+    return values
@@ -0,0 +1,144 @@
+"""
+Parallel energy scans for the batched shooting engine.
+
+A fine scan over a wide energy window is split into chunks which are
+shot on a ``concurrent.futures`` process pool.  The grid potential and
+the trial energies are handed to the workers once, through shared memory
+where the platform has it, so a task only carries the start and stop
+index of its chunk.  Neighbouring chunks share one energy, so a node
+count jump between the last energy of one chunk and the first of the
+next is still seen by exactly one worker.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+import shooting
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# arrays and shooting options seen by a worker process, set by _attach
+_worker = {}
+
+
+def _attach(arrays, options):
+    "pool initializer: maps the shared arrays into the worker process"
+    _worker.clear()
+    _worker['options'] = options
+    for name, spec in arrays.items():
+        if isinstance(spec, np.ndarray):
+            _worker[name] = spec
+        else:
+            memory_name, shape = spec
+            memory = shared_memory.SharedMemory(name=memory_name)
+            _worker[name + '_memory'] = memory
+            _worker[name] = np.ndarray(shape, dtype=float, buffer=memory.buf)
+
+
+def _scan_chunk(start, stop):
+    "shoots energies[start:stop] and returns the brackets where the node count goes up"
+    energies = _worker['energies'][start:stop]
+    node_counts, _, _ = shooting.shoot(energies, _worker['potential'],
+                                       **_worker['options'])
+    jumps = np.nonzero(node_counts[1:] > node_counts[:-1])[0]
+    return start + jumps, node_counts[jumps], node_counts[jumps + 1]
+
+
+def scan(energies, potential, dx, psi_0, dpsi_0, scale=1.0, cutoff=None,
+         integrator='euler', workers=None, chunks=None):
+    """
+    Shoot every trial energy on a process pool and bracket the levels.
+
+    Parameters
+    ----------
+    energies : array_like, float
+        increasing array of trial energies
+    potential, dx, psi_0, dpsi_0, scale, cutoff, integrator :
+        passed on to ``shooting.shoot``
+    workers : int, optional
+        number of worker processes.  If not specified, one per CPU.
+    chunks : int, optional
+        number of pieces the energies are cut into.  If not specified,
+        four per worker so that slow chunks do not hold up the pool.
+
+    Returns
+    -------
+    lower_index : ndarray, int
+        index into energies of the lower end of each bracket; the upper
+        end is the next energy
+    lower_count, upper_count : ndarray, int
+        node counts at the ends of each bracket
+    """
+    energies = np.ascontiguousarray(energies, dtype=float)
+    potential = np.ascontiguousarray(potential, dtype=float)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if chunks is None:
+        chunks = 4 * workers
+    chunks = max(1, min(chunks, len(energies) - 1))
+    bounds = np.linspace(0, len(energies) - 1, chunks + 1).astype(int)
+    options = dict(dx=dx, psi_0=psi_0, dpsi_0=dpsi_0, scale=scale,
+                   cutoff=cutoff, integrator=integrator)
+
+    memories = []
+    arrays = {}
+    try:
+        for name, array in (('energies', energies), ('potential', potential)):
+            if shared_memory is None:
+                arrays[name] = array
+                continue
+            memory = shared_memory.SharedMemory(create=True,
+                                                size=max(array.nbytes, 1))
+            memories.append(memory)
+            np.ndarray(array.shape, dtype=float, buffer=memory.buf)[...] = array
+            arrays[name] = (memory.name, array.shape)
+
+        with ProcessPoolExecutor(workers, initializer=_attach,
+                                 initargs=(arrays, options)) as executor:
+            results = list(executor.map(_scan_chunk, bounds[:-1],
+                                        bounds[1:] + 1))
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+    lower_index, lower_count, upper_count = [
+        np.concatenate(parts) for parts in zip(*results)]
+    return lower_index, lower_count, upper_count
+
+
+def find_eigenvalues(energies, potential, dx, psi_0, dpsi_0, scale=1.0,
+                     cutoff=None, integrator='euler', workers=None,
+                     chunks=None, tolerance=1e-6, refine='bisect',
+                     sections=16):
+    """
+    Bracket every level with a parallel ``scan`` and refine the brackets.
+
+    The scan does the bulk of the work; the few brackets it finds are
+    refined in this process by ``shooting.refine_brackets``.  Arguments
+    are as for ``scan`` and ``shooting.find_eigenvalues``.
+
+    Returns
+    -------
+    eigen_values : ndarray, float
+        sorted array of the eigenvalues found in the range
+    """
+    energies = np.asarray(energies, dtype=float)
+    lower_index, lower_count, upper_count = scan(
+        energies, potential, dx, psi_0, dpsi_0, scale, cutoff, integrator,
+        workers, chunks)
+
+    def evaluate(trial_energies):
+        node_counts, psi_end, _ = shooting.shoot(
+            trial_energies, potential, dx, psi_0, dpsi_0, scale, cutoff,
+            integrator=integrator)
+        return node_counts, psi_end
+
+    return shooting.refine_brackets(
+        energies[lower_index], energies[lower_index + 1], lower_count,
+        upper_count, evaluate, tolerance, refine, sections)
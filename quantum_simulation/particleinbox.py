@@ -1,9 +1,18 @@
+from __future__ import print_function
 # ============================================================================
-# Numerical and plotting libraries
+# Numerical libraries.  The plotting libraries are imported by show_plot, so
+# batch runs with --headless never load matplotlib.
+import functools
+import sys
 import numpy as np
-import pylab as pl
 import math
-from matplotlib.widgets import Slider, Button
+import batch
+import shooting
+import eigensolver
+import potentials
+import observables
+import cache
+import interactive
 # =============================================================================
 #
 # Simulation Constants.  Be sure to include decimal points on appropriate
@@ -17,6 +26,7 @@ BOX_TOTAL_DIVISION_CONSTANT = 10000  # number of spatial points to divide the bo
 BOX_PSI_u0_CONSTANT = 0  # value of wave function for 0th division
 BOX_PSI_u0_ddu_CONSTANT = 1  # value of derivative of wave function for 0th division
 BOX_PSI_uL_CONSTANT = 0  # value of wave function for last division
+BOX_PARTICLE_MASS = 0.25  # mass in units where hbar = 1, so d2psi by du2 = (potential - energy) * psi / 2
 # Variables for particle in a box potential
 # current_spatial_division; for short names it is referred to as 'u' in other related variable
 # psi_u; wave function as a function of u; pronounce psi of u
@@ -27,21 +37,40 @@ BOX_PSI_uL_CONSTANT = 0  # value of wave function for last division
 # These minimize the necessity of growing arrays, an expensive operation.
 psi_u_array = np.zeros(BOX_TOTAL_DIVISION_CONSTANT + 1)
 energy_eigen_values = []
+energy_eigen_vectors = np.zeros((0, BOX_TOTAL_DIVISION_CONSTANT + 1))
+eigen_integrator = 'euler'  # integrator the shooting methods found energy_eigen_values with
 # variables shared across gui callbacks, hence made global
 xaxis = np.arange(0.0, BOX_TOTAL_DIVISION_CONSTANT + 1, 1)
 plot = None
 s_energy = None
 axes = None
 displayed_energy_eigen_index = 0
+pl = None
+eigen_cache = None  # cache.EigenCache used by calculate_eigen_psi_cached
+psi_cache = None  # interactive.PsiCache of the wave functions shown by the slider
+update_callback = None
 # =============================================================================
 
 
+def set_constants(total_divisions=None, length=None, max_potential=None):
+    "changes the simulation constants and resizes the arrays that depend on them"
+    global BOX_TOTAL_DIVISION_CONSTANT, BOX_LENGTH_CONSTANT, BOX_MAX_POTENTIAL_CONSTANT
+    global psi_u_array, energy_eigen_vectors, xaxis
+    if total_divisions is not None:
+        BOX_TOTAL_DIVISION_CONSTANT = total_divisions
+    if length is not None:
+        BOX_LENGTH_CONSTANT = length
+    if max_potential is not None:
+        BOX_MAX_POTENTIAL_CONSTANT = max_potential
+    psi_u_array = np.zeros(BOX_TOTAL_DIVISION_CONSTANT + 1)
+    energy_eigen_vectors = np.zeros((0, BOX_TOTAL_DIVISION_CONSTANT + 1))
+    xaxis = np.arange(0.0, BOX_TOTAL_DIVISION_CONSTANT + 1, 1)
+
+
 def get_potential_particle_in_box(position):
     "returns potential at a position for particle in a box"
-    if (position < BOX_STARTING_POSITION or position > BOX_LENGTH_CONSTANT):
-        return BOX_MAX_POTENTIAL_CONSTANT
-    else:
-        return math.sqrt(0.25 - pow(position - 0.5, 2))
+    return float(potentials.particle_in_box(position, BOX_STARTING_POSITION, BOX_LENGTH_CONSTANT,
+                                            BOX_MAX_POTENTIAL_CONSTANT))
 
 
 def get_position(current_division):
@@ -53,33 +82,92 @@ def get_dx():
     return (BOX_LENGTH_CONSTANT / BOX_TOTAL_DIVISION_CONSTANT)
 
 
+def get_potential_array(position=None):
+    "returns potential at every division, or at the given positions, as a numpy array"
+    "the array for the divisions is computed once and shared, so it must not be modified"
+    if position is not None:
+        return potentials.particle_in_box(position, BOX_STARTING_POSITION, BOX_LENGTH_CONSTANT,
+                                          BOX_MAX_POTENTIAL_CONSTANT)
+    return potentials.potential_array('box', get_dx(), BOX_TOTAL_DIVISION_CONSTANT + 1,
+                                      start=BOX_STARTING_POSITION, length=BOX_LENGTH_CONSTANT,
+                                      height=BOX_MAX_POTENTIAL_CONSTANT)
+
+
 def print_summary():
     "prints all constants"
-    print 'One-dimensional Schrodinger equation'
-    print "Potential type: particle in a box"
-    print "Wave function (psi) at 0: ", BOX_PSI_u0_CONSTANT
-    print "Wave function at L", BOX_PSI_uL_CONSTANT
-    print "Derivative of Wave function at 0: ", BOX_PSI_u0_ddu_CONSTANT
-    print 'Potential height: ', BOX_MAX_POTENTIAL_CONSTANT
-    print "Box Length: ", BOX_LENGTH_CONSTANT
-    print "Box starting coordinate", BOX_STARTING_POSITION
-    print "total divisions to use while calculating", BOX_TOTAL_DIVISION_CONSTANT
+    print('One-dimensional Schrodinger equation')
+    print("Potential type: particle in a box")
+    print("Wave function (psi) at 0: ", BOX_PSI_u0_CONSTANT)
+    print("Wave function at L", BOX_PSI_uL_CONSTANT)
+    print("Derivative of Wave function at 0: ", BOX_PSI_u0_ddu_CONSTANT)
+    print('Potential height: ', BOX_MAX_POTENTIAL_CONSTANT)
+    print("Box Length: ", BOX_LENGTH_CONSTANT)
+    print("Box starting coordinate", BOX_STARTING_POSITION)
+    print("total divisions to use while calculating", BOX_TOTAL_DIVISION_CONSTANT)
+
+
+def print_convergence_report(target=1e-4, level=0):
+    "prints the number of divisions each integrator needs to find the"
+    "level-th eigen value to within target"
+    reference, rows, needed = shooting.convergence_report(
+        get_potential_array, BOX_STARTING_POSITION, BOX_LENGTH_CONSTANT,
+        np.arange(0.0, 200.0, 1.0), BOX_PSI_u0_CONSTANT, BOX_PSI_u0_ddu_CONSTANT,
+        scale=2 * BOX_PARTICLE_MASS, level=level, target=target)
+    print("reference eigen value", reference)
+    print("integrator, divisions, eigen value, error")
+    for integrator, points, eigen_value, error in rows:
+        print(integrator, points - 1, eigen_value, error)
+    for integrator in shooting.INTEGRATORS:
+        if needed[integrator] is None:
+            print(integrator, "does not reach", target, "on any grid tried")
+        else:
+            print(integrator, "needs", needed[integrator] - 1, "divisions for", target)
 
 
 def calculate_expectation(assumed_energy):
-    sq_sum = 0
-    for current_spatial_division in range(0, BOX_TOTAL_DIVISION_CONSTANT + 1):
-        psi_u = psi_u_array[current_spatial_division]
-        sq_sum = sq_sum + (pow(psi_u, 2) * get_dx())
-    print "normalization constant", sq_sum
-    expectation = 0
-    for current_spatial_division in range(0, BOX_TOTAL_DIVISION_CONSTANT + 1):
-        psi_u = psi_u_array[current_spatial_division]
-        potential = get_potential_particle_in_box(get_position(current_spatial_division))
-        psi_u_d2du2 = (potential - assumed_energy) * psi_u / 2  # psi by du2 at current division
-        expectation = expectation + (psi_u * psi_u_d2du2 * get_dx())
-    expectation = expectation / (-sq_sum * sq_sum)
-    print "Expectation of p2 ", expectation
+    "prints normalization constant and expectation values of psi_u_array"
+    values = observables.expectation_values(psi_u_array, get_dx(), get_position(xaxis),
+                                            get_potential_array(), m=BOX_PARTICLE_MASS)
+    print("normalization constant", values['norm'])
+    print("Expectation of p2 ", values['p2'])
+    print("Expectation of H", values['H'], "for energy", assumed_energy)
+    print("Uncertainty product", values['uncertainty'])
+
+
+def get_eigen_states():
+    "returns the wave functions of every eigen state in energy_eigen_values"
+    if len(energy_eigen_vectors) == len(energy_eigen_values):
+        return energy_eigen_vectors
+    _, _, eigen_states = shooting.shoot(energy_eigen_values, get_potential_array(), get_dx(),
+                                        BOX_PSI_u0_CONSTANT, BOX_PSI_u0_ddu_CONSTANT,
+                                        scale=2 * BOX_PARTICLE_MASS, store_psi=True,
+                                        integrator=eigen_integrator)
+    return eigen_states
+
+
+def calculate_eigen_expectations():
+    "returns expectation values of every eigen state in energy_eigen_values,"
+    "computed for all of them in one batched call"
+    return observables.expectation_values(get_eigen_states(), get_dx(), get_position(xaxis),
+                                          get_potential_array(), m=BOX_PARTICLE_MASS)
+
+
+def save_results(path, args):
+    "writes eigen values, eigen states and their expectation values to an npz file"
+    values = calculate_eigen_expectations()
+    arrays = dict(('expectation_' + name, value) for name, value in values.items())
+    batch.save_results(path, args, eigen_values=np.array(energy_eigen_values),
+                       eigen_states=get_eigen_states(), position=get_position(xaxis),
+                       potential=get_potential_array(), **arrays)
+
+
+def print_eigen_expectations():
+    "prints expectation values of every eigen state in energy_eigen_values"
+    values = calculate_eigen_expectations()
+    print("eigen value, <x>, <p2>, <V>, <H>, uncertainty product")
+    for index in range(len(energy_eigen_values)):
+        print(energy_eigen_values[index], values['x'][index], values['p2'][index],
+              values['V'][index], values['H'][index], values['uncertainty'][index])
 
 
 def calculate_psi(assumed_energy):
@@ -90,10 +178,11 @@ def calculate_psi(assumed_energy):
     psi_u_ddu = BOX_PSI_u0_ddu_CONSTANT
     psi_u_d2du2 = 0
     xaxis_cut_number = 0
+    potential_list = get_potential_array().tolist()
     # runs for one extra because we are storing the value in the beginning
     for current_spatial_division in range(0, BOX_TOTAL_DIVISION_CONSTANT + 1):
         psi_u_array[current_spatial_division] = psi_u  # storing psi of current division
-        potential = get_potential_particle_in_box(get_position(current_spatial_division))
+        potential = potential_list[current_spatial_division]
         psi_u_d2du2 = (potential - assumed_energy) * psi_u / 2  # psi by du2 at current division
         psi_u_ddu = psi_u_ddu + psi_u_d2du2 * get_dx()  # psi by du at next division
         psi_u = psi_u + psi_u_ddu * get_dx()  # psi at next division Using backward eular method
@@ -104,31 +193,160 @@ def calculate_psi(assumed_energy):
     return xaxis_cut_number
 
 
-def calculate_eigen_psi(lower_limit, upper_limit, interval_size):
-    global energy_eigen_values
+def get_stored_eigen_state(assumed_energy):
+    "returns the stored wave function of the eigen value assumed_energy, or None"
+    if len(energy_eigen_vectors) != len(energy_eigen_values):
+        return None
+    if assumed_energy not in energy_eigen_values:
+        return None
+    return energy_eigen_vectors[energy_eigen_values.index(assumed_energy)]
+
+
+def compute_psi(assumed_energy):
+    "returns a copy of the wave function at assumed_energy, from the integrator of the eigen values"
+    psi = get_stored_eigen_state(assumed_energy)
+    if psi is not None:
+        return psi.copy()
+    return get_psi_batch([assumed_energy], get_potential_array())[0]
+
+
+def get_psi_batch(energies, potential):
+    "returns the wave functions of every energy for the grid potential, without touching"
+    "psi_u_array or the potential cache, so it can run on another thread"
+    _, _, psi = shooting.shoot(energies, potential, get_dx(), BOX_PSI_u0_CONSTANT,
+                               BOX_PSI_u0_ddu_CONSTANT, scale=2 * BOX_PARTICLE_MASS,
+                               store_psi=True, integrator=eigen_integrator)
+    for index, energy in enumerate(energies):
+        # eigen states are the ones the eigen value search stored
+        stored = get_stored_eigen_state(energy)
+        if stored is not None:
+            psi[index] = stored
+    return psi
+
+
+def calculate_eigen_psi(lower_limit, upper_limit, interval_size, method='batched', tolerance=1e-6,
+                        integrator='euler', workers=None):
+    "scans energies from lower_limit to upper_limit in steps of interval_size"
+    "method is 'loop' for one calculate_psi call per energy, 'batched'"
+    "to march all energies across the grid together, 'bracket' to use"
+    "interval_size as a coarse grid and refine each eigenvalue to tolerance,"
+    "or 'tridiagonal' to diagonalize the grid hamiltonian in one call"
+    "'parallel' is 'bracket' with the scan shared among workers processes"
+    "integrator is 'euler', 'numerov' or 'rk4' for the shooting methods"
+    global energy_eigen_values, energy_eigen_vectors, psi_u_array, eigen_integrator
     if (lower_limit >= upper_limit or upper_limit - lower_limit <= interval_size):
         return False
+    # the loop always steps with calculate_psi, which is the euler integrator
+    eigen_integrator = 'euler' if method == 'loop' else integrator
+    if method == 'tridiagonal':
+        eigen_values, energy_eigen_vectors = eigensolver.solve(
+            get_potential_array(), get_dx(), scale=2 * BOX_PARTICLE_MASS,
+            lower_limit=lower_limit, upper_limit=upper_limit)
+        energy_eigen_values.extend(eigen_values.tolist())
+        if len(eigen_values) != 0:
+            psi_u_array[:] = energy_eigen_vectors[0]
+        print("eigen values", energy_eigen_values)
+        return
     iteration_size = (upper_limit - lower_limit) / interval_size
+    energies = lower_limit + np.arange(int(math.ceil(iteration_size))) * interval_size
+    if method == 'bracket':
+        energies = np.append(energies, upper_limit)
+        energy_eigen_values.extend(shooting.find_eigenvalues(
+            energies, get_potential_array(), get_dx(), BOX_PSI_u0_CONSTANT,
+            BOX_PSI_u0_ddu_CONSTANT, scale=2 * BOX_PARTICLE_MASS, tolerance=tolerance,
+            integrator=integrator).tolist())
+        print("eigen values", energy_eigen_values)
+        return
+    if method == 'parallel':
+        import parallel  # needs python 3.7 or later
+        energies = np.append(energies, upper_limit)
+        energy_eigen_values.extend(parallel.find_eigenvalues(
+            energies, get_potential_array(), get_dx(), BOX_PSI_u0_CONSTANT,
+            BOX_PSI_u0_ddu_CONSTANT, scale=2 * BOX_PARTICLE_MASS, integrator=integrator,
+            workers=workers, tolerance=tolerance).tolist())
+        print("eigen values", energy_eigen_values)
+        return
+    if method == 'batched':
+        xaxis_cuts, psi_end, _ = shooting.shoot(energies, get_potential_array(), get_dx(),
+                                               BOX_PSI_u0_CONSTANT, BOX_PSI_u0_ddu_CONSTANT,
+                                               scale=2 * BOX_PARTICLE_MASS, integrator=integrator)
+        prev_xaxis_cuts = 1
+        for assumed_energy, cuts in zip(energies, xaxis_cuts):
+            if cuts > prev_xaxis_cuts:
+                energy_eigen_values.append(round(float(assumed_energy), 4))
+                prev_xaxis_cuts += 1
+        print("eigen values", energy_eigen_values)
+        return
     index = 0
     prev_xaxis_cuts = 1
     while index < iteration_size:
         assumed_energy = lower_limit + index * interval_size
-        print assumed_energy
+        print(assumed_energy)
         if calculate_psi(assumed_energy) > prev_xaxis_cuts:
             energy_eigen_values.append(round(assumed_energy, 4))
             prev_xaxis_cuts += 1
         index += 1
-    print "eigen values", energy_eigen_values
+    print("eigen values", energy_eigen_values)
+
+
+def get_cache_key(lower_limit, upper_limit, interval_size, method, tolerance, integrator):
+    "returns the key of an eigen search in the eigen cache"
+    if method == 'parallel':
+        method = 'bracket'  # the same search with the scan shared among processes
+    if method == 'tridiagonal':
+        interval_size = tolerance = integrator = None  # not used by the tridiagonal solver
+    return cache.cache_key(potential='box', potential_array=get_potential_array(),
+                           start=BOX_STARTING_POSITION, length=BOX_LENGTH_CONSTANT,
+                           max_potential=BOX_MAX_POTENTIAL_CONSTANT,
+                           divisions=BOX_TOTAL_DIVISION_CONSTANT, psi_0=BOX_PSI_u0_CONSTANT,
+                           dpsi_0=BOX_PSI_u0_ddu_CONSTANT, psi_L=BOX_PSI_uL_CONSTANT,
+                           mass=BOX_PARTICLE_MASS, method=method, lower=lower_limit,
+                           upper=upper_limit, interval=interval_size, tolerance=tolerance,
+                           integrator=integrator)
+
+
+def calculate_eigen_psi_cached(lower_limit, upper_limit, interval_size, method='batched',
+                               tolerance=1e-6, integrator='euler', workers=None):
+    "calculate_eigen_psi through eigen_cache: a search already run with the same"
+    "constants and settings is loaded from disk, and a new one is stored there"
+    global energy_eigen_vectors, eigen_integrator
+    key = get_cache_key(lower_limit, upper_limit, interval_size, method, tolerance, integrator)
+    first = len(energy_eigen_values)
+    cached = eigen_cache.load(key)
+    if cached is None:
+        if calculate_eigen_psi(lower_limit, upper_limit, interval_size, method, tolerance,
+                               integrator, workers) is False:
+            return False
+        eigen_states = get_eigen_states()
+        if first == 0:
+            energy_eigen_vectors = eigen_states
+        eigen_cache.store(key, energy_eigen_values[first:], eigen_states[first:])
+        return
+    eigen_values, eigen_vectors = cached
+    eigen_integrator = 'euler' if method == 'loop' else integrator
+    energy_eigen_values.extend(eigen_values.tolist())
+    if first == 0:
+        energy_eigen_vectors = eigen_vectors
+    if len(eigen_values) != 0:
+        psi_u_array[:] = eigen_vectors[0]
+    print("eigen values (cached)", energy_eigen_values)
 
 
 def show_plot():
-    global s_energy, plot, axes
+    global s_energy, plot, axes, pl, psi_cache, update_callback
+    import pylab as pl
+    from matplotlib.widgets import Slider, Button
+    # wave functions of the slider, with the eigen states computed up front
+    # so Previous, Next and Reset never wait
+    # the prefetch thread gets its own reference to the potential, as the
+    # potential cache behind get_potential_array is not thread safe
+    psi_cache = interactive.PsiCache(compute_psi, resolution=0.1,
+                                     compute_batch=functools.partial(get_psi_batch,
+                                                                     potential=get_potential_array()))
+    psi_cache.fill(energy_eigen_values, exact=True)
     plot, = pl.plot(xaxis, psi_u_array, '-')
     pl.plot(xaxis, np.zeros(BOX_TOTAL_DIVISION_CONSTANT + 1), '.-')
-    potential = []
-    for current_division in range(0, len(xaxis)):
-        potential.append(get_potential_particle_in_box(get_position(xaxis[current_division])))
-    pl.plot(xaxis, potential, '-')
+    pl.plot(xaxis, get_potential_array(), '-')
     # reposition plot for adding space for sliders
     pl.subplots_adjust(bottom=0.25)
     # axis labels and title
@@ -137,16 +355,17 @@ def show_plot():
     pl.title('Potential type: particle in a box')
     # marking in plot
     pl.grid(True)
-    x_scale = BOX_TOTAL_DIVISION_CONSTANT / 10
-    y_scale = abs(max(psi_u_array) - min(psi_u_array)) / 4
-    pl.xticks(np.arange(min(xaxis), max(xaxis), x_scale))
-    pl.yticks(np.arange(min(psi_u_array), max(psi_u_array), min(y_scale, 1)))
+    x_scale = BOX_TOTAL_DIVISION_CONSTANT // 10
+    pl.xticks(np.arange(xaxis[0], xaxis[-1], x_scale))
+    pl.yticks(interactive.psi_ticks(psi_u_array))
     axes = pl.gca()
     # show slider for E
-    ax_energy = pl.axes([0.25, 0.1, 0.65, 0.03], axisbg='lightgoldenrodyellow')
+    ax_energy = pl.axes([0.25, 0.1, 0.65, 0.03], facecolor='lightgoldenrodyellow')
     default_energy_value = 0.0e0
     s_energy = Slider(ax_energy, 'Energy', 0.0, 100.0, valinit=default_energy_value)
-    s_energy.on_changed(updateOnClick)
+    # a drag sends many events; only the latest one is computed and drawn
+    update_callback = interactive.CoalescedCallback(axes.figure.canvas, updateOnClick)
+    s_energy.on_changed(update_callback)
     # show reset button
     resetax = pl.axes([0.5, 0.025, 0.1, 0.04])
     reset_button = Button(resetax, 'Reset', color='lightgoldenrodyellow', hovercolor='0.975')
@@ -165,17 +384,16 @@ def show_plot():
 
 def updateOnClick(val):
     global plot
-    print "new value", s_energy.val
+    print("new value", s_energy.val)
     assumed_energy = s_energy.val
-    calculate_psi(assumed_energy)
-    plot.set_ydata(psi_u_array)
-    x_scale = BOX_TOTAL_DIVISION_CONSTANT / 10
-    axes.xaxis.set_ticks(np.arange(min(xaxis), max(xaxis), x_scale))
-    y_scale = abs(max(psi_u_array) - min(psi_u_array)) / 4
-    axes.yaxis.set_ticks(np.arange(min(psi_u_array), max(psi_u_array), min(y_scale, 1)))
+    # eigen values are shown exactly, other energies to the cache resolution
+    assumed_energy, psi = psi_cache.get(assumed_energy, assumed_energy in energy_eigen_values)
+    psi_u_array[:] = psi
+    plot.set_ydata(psi)
+    axes.yaxis.set_ticks(interactive.psi_ticks(psi))
     axes.relim()
     axes.autoscale_view(True, True, True)
-    pl.draw()
+    axes.figure.canvas.draw_idle()
     calculate_expectation(assumed_energy)
 
 
@@ -200,19 +418,65 @@ def nextOnClick(event):
     s_energy.set_val(energy_eigen_values[displayed_energy_eigen_index])
 
 
-def main():
-    global displayed_energy_eigen_index
+def main(argv=None):
+    global displayed_energy_eigen_index, eigen_cache, energy_eigen_vectors
+    parser = batch.argument_parser('Particle in a box solved by the shooting method.')
+    parser.add_argument('--lower', type=float, default=19.5, help='lowest energy to search')
+    parser.add_argument('--upper', type=float, default=20.5, help='highest energy to search')
+    parser.add_argument('--interval', type=float,
+                        help='energy step of the scan, or of the coarse grid for bracket '
+                        '(default: 0.001 for loop and batched, 0.1 otherwise)')
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help='eigen value accuracy for the bracket method')
+    parser.add_argument('--method', default='loop',
+                        choices=['loop', 'batched', 'bracket', 'tridiagonal', 'parallel'])
+    parser.add_argument('--integrator', default='euler', choices=shooting.INTEGRATORS)
+    parser.add_argument('--workers', type=int,
+                        help='worker processes for the parallel method (default: one per CPU)')
+    parser.add_argument('--divisions', type=int, default=BOX_TOTAL_DIVISION_CONSTANT,
+                        help='number of spatial points to divide the box length into')
+    parser.add_argument('--length', type=float, default=BOX_LENGTH_CONSTANT, help='length of the box')
+    parser.add_argument('--max-potential', type=float, default=BOX_MAX_POTENTIAL_CONSTANT,
+                        help='potential outside the box')
+    parser.add_argument('--convergence-report', action='store_true',
+                        help='print the divisions each integrator needs and exit')
+    cache.add_arguments(parser)
+    args = batch.parse_arguments(parser, argv)
+    if args.interval is None:
+        # the scans keep the step of the original loop, the bracket search only needs
+        # a coarse grid
+        args.interval = 0.001 if args.method in ('loop', 'batched') else 0.1
+    if args.method == 'parallel' and sys.version_info < (3, 7):
+        parser.error('--method parallel needs python 3.7 or later')
+    set_constants(args.divisions, args.length, args.max_potential)
     print_summary()
-    energy_lower_limit = 19.5
-    energy_upper_limit = 20.5
-    energy_interval = 0.001
-    calculate_eigen_psi(energy_lower_limit, energy_upper_limit, energy_interval)
+    if args.convergence_report:
+        print_convergence_report()
+        return
+    eigen_cache = cache.open_cache(args)
+    if eigen_cache is None:
+        calculate_eigen_psi(args.lower, args.upper, args.interval, method=args.method,
+                            tolerance=args.tolerance, integrator=args.integrator,
+                            workers=args.workers)
+    else:
+        calculate_eigen_psi_cached(args.lower, args.upper, args.interval, method=args.method,
+                                   tolerance=args.tolerance, integrator=args.integrator,
+                                   workers=args.workers)
+    # the states are kept, so the plot and the output show the same ones
+    energy_eigen_vectors = get_eigen_states()
+    if len(energy_eigen_values) != 0:
+        print_eigen_expectations()
+    if args.output:
+        save_results(args.output, args)
+    if args.headless:
+        return
     if len(energy_eigen_values) != 0:
-        calculate_psi(energy_eigen_values[displayed_energy_eigen_index])
+        psi_u_array[:] = energy_eigen_vectors[displayed_energy_eigen_index]
         show_plot()
         s_energy.set_val(energy_eigen_values[displayed_energy_eigen_index])
     else:
         show_plot()
-    print "Good bye!"
+    print("Good bye!")
 
-main()  # start main function
+if __name__ == '__main__':
+    main()  # start main function
@@ -0,0 +1,155 @@
+"""
+Registry of vectorized potentials shared by the simulators.
+
+Every potential is a function taking an array of positions plus keyword
+parameters and returning the potential at those positions.  Grids follow
+the convention of the shooting scripts: the i-th point of a grid sits at
+(first_division + i) * dx.  ``potential_array`` evaluates a potential once
+per grid and parameter set and hands out the same read-only array to the
+solver, the expectation values and the plot.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_SIZE = 32
+
+_potentials = {}
+_cache = OrderedDict()
+
+
+def register_potential(name, function):
+    """
+    Make a potential available under ``name``.
+
+    Parameters
+    ----------
+    name : string
+        name used to look the potential up
+    function : callable
+        function(position, **parameters) returning an array shaped like
+        position.  It must work on whole arrays, not single points.
+    """
+    _potentials[name] = function
+    for key in [key for key in _cache if key[0] == name]:
+        del _cache[key]
+
+
+def get_potential(name):
+    "returns the function registered under name"
+    try:
+        return _potentials[name]
+    except KeyError:
+        raise KeyError("unknown potential %r, registered potentials are %s"
+                       % (name, sorted(_potentials)))
+
+
+def grid_positions(dx, points, first_division=0):
+    "returns the positions of a grid of points spaced dx apart"
+    return (first_division + np.arange(points)) * dx
+
+
+def potential_array(name, dx, points, first_division=0, **parameters):
+    """
+    Return the potential evaluated on a grid, computing it only once.
+
+    Parameters
+    ----------
+    name : string
+        name of a registered potential
+    dx : float
+        grid spacing
+    points : int
+        number of grid points
+    first_division : int
+        division number of the first grid point (default = 0)
+    **parameters :
+        passed on to the potential function
+
+    Returns
+    -------
+    potential : ndarray, float
+        read-only length-points array.  Copy it before modifying.
+    """
+    key = (name, float(dx), int(points), int(first_division),
+           tuple(sorted(parameters.items())))
+    try:
+        potential = _cache.pop(key)
+    except KeyError:
+        function = get_potential(name)
+        position = grid_positions(dx, points, first_division)
+        potential = np.array(function(position, **parameters), dtype=float)
+        potential.flags.writeable = False
+        if len(_cache) >= CACHE_SIZE:
+            _cache.popitem(last=False)
+    _cache[key] = potential
+    return potential
+
+
+def clear_cache():
+    "forgets every cached potential array"
+    _cache.clear()
+
+
+######################################################################
+# Built-in potentials
+
+def particle_in_box(position, start=0.0, length=1.0, height=500000.0):
+    """
+    semicircular bump inside the box [start, start + length] and a wall of
+    the given height outside it
+    """
+    position = np.asarray(position, dtype=float)
+    inside = (position >= start) & (position <= start + length)
+    radius = 0.5 * length
+    bump = np.where(inside, radius ** 2 - (position - start - radius) ** 2, 0.0)
+    return np.where(inside, np.sqrt(bump), height)
+
+
+def symmetric(position, slope=2.0):
+    "linear potential symmetric about the origin, slope * |x|"
+    return slope * np.abs(position)
+
+
+def coulomb(position, charge=1.0):
+    """
+    attractive coulomb potential -charge / |x| in atomic units, -inf at the
+    origin
+    """
+    position = np.abs(np.asarray(position, dtype=float))
+    with np.errstate(divide='ignore'):
+        return -charge / position
+
+
+def theta(x):
+    """
+    theta function :
+      returns 0 if x<=0, and 1 if x>0
+    """
+    x = np.asarray(x)
+    y = np.zeros(x.shape)
+    y[x > 0] = 1.0
+    return y
+
+
+def square_barrier(x, width, height):
+    return height * (theta(x) - theta(x - width))
+
+
+def absorbing_layer(x, width, strength):
+    """
+    W(x) of a complex absorbing potential V(x) - i W(x) on the grid x: zero
+    inside, rising as strength * (d / width)^2 over the last width of the
+    grid at either end, d being the depth into the layer.  It is not a
+    potential of its own, so it is not registered.
+    """
+    x = np.asarray(x, dtype=float)
+    depth = np.maximum(x[0] + width - x, x - (x[-1] - width))
+    return strength * (np.maximum(depth, 0) / width) ** 2
+
+
+register_potential('box', particle_in_box)
+register_potential('symmetric', symmetric)
+register_potential('barrier', square_barrier)
+register_potential('coulomb', coulomb)
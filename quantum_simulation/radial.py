@@ -0,0 +1,225 @@
+"""
+Radial solver for spherically symmetric potentials in three dimensions.
+
+Writing the wave function as psi = u(r) / r * Y_lm, the radial part obeys
+
+    u''(r) = scale * (V(r) - E) * u(r) + l (l + 1) / r^2 * u(r)
+
+with u(0) = 0, where scale = 2m / hbar^2 as in the shooting scripts.  The
+grid follows the convention of ``potentials``: r_i = i * dr, so the first
+grid point is the origin and the potential there is never used.
+
+``shoot`` marches a whole block of angular momentum channels and trial
+energies across the grid together with the Numerov method, counting the
+nodes of every u on the way.  ``find_eigenvalues`` brackets the levels of
+every channel from the node counts on a coarse energy grid and refines all
+the brackets in the same batched sweeps.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+import batch
+import potentials
+
+# solutions are scaled down once they reach this size
+RESCALE = 1e100
+
+
+def shoot(energies, potential, dr, l, scale=2.0, store_u=False):
+    """
+    Integrate u(r) for every angular momentum and trial energy in one pass.
+
+    Parameters
+    ----------
+    energies : array_like, float
+        trial energies
+    potential : array_like, float
+        length-N array of the potential at r = 0, dr, ..., (N - 1) dr
+    dr : float
+        grid spacing
+    l : array_like, int
+        angular momentum quantum numbers, broadcast against energies
+    scale : float
+        2m / hbar^2 (default = 2, an electron in atomic units)
+    store_u : bool
+        if True, also return the array of u on the grid
+
+    Returns
+    -------
+    node_counts : ndarray, int
+        number of times each u cuts the r axis, shaped like the broadcast
+        of energies and l
+    u_end : ndarray, float
+        u at the last grid point, which is zero at the levels
+    u : ndarray, float or None
+        array of shape node_counts.shape + (N,) if ``store_u`` is set.
+        Every u is scaled by an arbitrary positive factor.
+    """
+    energies, l = np.broadcast_arrays(np.asarray(energies, dtype=float),
+                                      np.asarray(l, dtype=float))
+    potential = np.asarray(potential, dtype=float)
+    N = potential.size
+    r = dr * np.arange(N)
+    h2 = dr * dr / 12.0
+    centrifugal = l * (l + 1)
+
+    def numerov_factor(index):
+        f = scale * (potential[index] - energies) + centrifugal / r[index] ** 2
+        return 1.0 - h2 * f
+
+    # close to the origin a high l barrier is too steep for the Numerov step,
+    # and u ~ r^(l + 1) is negligible there, so u starts once 1 - factor < 1/2
+    start = np.maximum(1, np.ceil(np.sqrt(centrifugal / 6.0))).astype(int)
+    u_previous = np.zeros(energies.shape)
+    u = (start == 1).astype(float)
+    # g[0] * u[0] is not zero at the origin for l = 0 and a coulomb like
+    # potential: its limit is -dr^2 / 12 * scale * r V(r) * u'(0)
+    origin_term = np.where(l == 0, -h2 * scale * potential[1] * u, 0.0)
+    factor_previous = np.ones(energies.shape)
+    factor = numerov_factor(1)
+    node_counts = np.zeros(energies.shape, dtype=int)
+    stored = np.zeros(energies.shape + (N,)) if store_u else None
+    if store_u:
+        stored[..., 1] = u
+
+    for index in range(1, N - 1):
+        factor_next = numerov_factor(index + 1)
+        if index == 1:
+            previous_term = origin_term
+        else:
+            previous_term = factor_previous * u_previous
+        u_next = ((12.0 - 10.0 * factor) * u - previous_term) / factor_next
+        u_next[start == index + 1] = 1.0
+        started = start <= index
+        node_counts += started & (u * u_next < 0)
+        node_counts += started & (u_next == 0)
+        big = np.abs(u_next) > RESCALE
+        if big.any():
+            # a positive factor leaves the nodes where they are
+            shrink = np.where(big, 1.0 / RESCALE, 1.0)
+            u, u_next = u * shrink, u_next * shrink
+            if store_u:
+                stored[..., :index + 1] *= shrink[..., None]
+        u_previous, u = u, u_next
+        factor_previous, factor = factor, factor_next
+        if store_u:
+            stored[..., index + 1] = u
+
+    return node_counts, u, stored
+
+
+def find_eigenvalues(energies, potential, dr, l_values, scale=2.0,
+                     tolerance=1e-6, sections=16):
+    """
+    Find the levels of every angular momentum channel in a range of energies.
+
+    Parameters
+    ----------
+    energies : array_like, float
+        increasing coarse grid of trial energies shared by every channel.
+        Any number of levels may fall between two of them.
+    potential, dr, scale :
+        as for ``shoot``
+    l_values : array_like, int
+        angular momentum quantum numbers to solve for
+    tolerance : float
+        width below which a bracket is taken as converged (default = 1e-6)
+    sections : int
+        pieces a bracket is cut into per batched sweep (default = 16)
+
+    Returns
+    -------
+    l : ndarray, int
+        angular momentum of each level
+    nodes : ndarray, int
+        radial quantum number of each level, the number of nodes of u
+        (for hydrogen, n = nodes + l + 1)
+    eigen_values : ndarray, float
+        energy of each level, sorted by l and then by energy
+    """
+    energies = np.asarray(energies, dtype=float)
+    l_values = np.asarray(l_values, dtype=int)
+    counts, _, _ = shoot(energies[None, :], potential, dr, l_values[:, None],
+                         scale)
+
+    # one bracket per level: the level with n nodes lies where the node
+    # count goes from n or fewer to more than n
+    channel, index = np.nonzero(counts[:, 1:] > counts[:, :-1])
+    repeats = counts[channel, index + 1] - counts[channel, index]
+    channel = np.repeat(channel, repeats)
+    index = np.repeat(index, repeats)
+    nodes = counts[channel, index] + np.concatenate(
+        [np.arange(repeat) for repeat in repeats] + [np.zeros(0, dtype=int)])
+    lower, upper = energies[index], energies[index + 1]
+
+    fractions = np.arange(1, sections) / float(sections)
+    while np.any(upper - lower > tolerance):
+        points = lower[:, None] + (upper - lower)[:, None] * fractions
+        point_counts, _, _ = shoot(points, potential, dr,
+                                   l_values[channel][:, None], scale)
+        below = (point_counts <= nodes[:, None]).sum(axis=1)
+        points = np.column_stack((lower, points, upper))
+        rows = np.arange(len(points))
+        lower, upper = points[rows, below], points[rows, below + 1]
+
+    eigen_values = 0.5 * (lower + upper)
+    order = np.lexsort((eigen_values, l_values[channel]))
+    return l_values[channel][order], nodes[order], eigen_values[order]
+
+
+def show_plot(l, eigen_values, exact, charge):
+    "plots the levels found in every l channel on top of the exact ones"
+    import pylab as pl
+    pl.plot(l, exact, '_', color='k', markersize=24, label='exact')
+    pl.plot(l, eigen_values, '.', color='r', label='radial shooting')
+    pl.xlabel('angular momentum l')
+    pl.ylabel('Energy (hartree)')
+    pl.title('Levels of a hydrogen like atom, Z = %g' % charge)
+    pl.legend(loc='lower right')
+    pl.grid(True)
+    pl.show()
+
+
+def main(argv=None):
+    "prints the levels of a hydrogen like atom in atomic units, and plots them"
+    "unless --headless is given"
+    parser = batch.argument_parser('Levels of a hydrogen like atom from the radial equation.')
+    parser.add_argument('--charge', type=float, default=1.0, help='nuclear charge Z')
+    parser.add_argument('--max-l', type=int, default=20, help='highest angular momentum')
+    parser.add_argument('--max-n', type=int, default=22, help='highest principal number sought')
+    parser.add_argument('--dr', type=float, default=0.05, help='radial grid spacing')
+    parser.add_argument('--points', type=int, help='number of grid points '
+                        '(default: enough to hold the largest orbit of max-n)')
+    parser.add_argument('--energies', type=int, default=200,
+                        help='points of the coarse energy grid')
+    parser.add_argument('--tolerance', type=float, default=1e-7)
+    args = batch.parse_arguments(parser, argv)
+
+    points = args.points
+    if points is None:
+        points = int(3.0 * args.max_n ** 2 / args.charge / args.dr) + 1
+    potential = potentials.potential_array('coulomb', args.dr, points, charge=args.charge)
+    lowest = -0.6 * args.charge ** 2
+    highest = -0.5 * args.charge ** 2 / (args.max_n + 0.5) ** 2
+    energies = np.linspace(lowest, highest, args.energies)
+    l, nodes, eigen_values = find_eigenvalues(energies, potential, args.dr,
+                                              np.arange(args.max_l + 1),
+                                              tolerance=args.tolerance)
+    n = nodes + l + 1
+    exact = -0.5 * args.charge ** 2 / n ** 2
+    print("l, n, eigen value, exact, error")
+    for row in zip(l, n, eigen_values, exact, eigen_values - exact):
+        print(*row)
+    if args.output:
+        batch.save_results(args.output, args, l=l, n=n, eigen_values=eigen_values,
+                           position=potentials.grid_positions(args.dr, points),
+                           potential=potential)
+    if args.headless:
+        return
+    show_plot(l, eigen_values, exact, args.charge)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""
+Split-step solver for the time-dependent Schrodinger equation in two or
+three dimensions.
+
+``SchrodingerND`` keeps the scheme, the in-place transforms and the
+dt-keyed caching of ``animate.Schrodinger`` and only changes the grid: one
+coordinate array per axis, each with its own length and spacing, and
+``fftn`` over all of them.  The kinetic factor and the phase factors are
+products of one factor per axis, so when the full arrays do not fit in
+``memory_budget`` they are applied axis by axis from one dimensional
+arrays instead.
+
+``two_slit_simulation`` and ``barrier_simulation`` set up the two
+standard demonstrations; ``python splitstep_nd.py`` animates them.
+"""
+
+from __future__ import print_function
+
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+from scipy import fftpack
+
+from animate import (Schrodinger, SCHEMES, FACTOR_CACHE_SIZE, scipy_fft,
+                     gauss_x)
+import batch
+
+
+class _Separable(object):
+    """
+    Product of one dimensional factors, one along each axis of a grid,
+    kept either as the full array or as the factors themselves, cast to
+    dtype once the product is formed
+    """
+    def __init__(self, factors, full, dtype=complex):
+        ndim = len(factors)
+        factors = [np.asarray(factor).reshape(
+            (1,) * axis + (-1,) + (1,) * (ndim - axis - 1))
+            for axis, factor in enumerate(factors)]
+        self.factors = [factor.astype(dtype) for factor in factors]
+        self.full = None
+        if full:
+            product = factors[0]
+            for factor in factors[1:]:
+                product = product * factor
+            self.full = product.astype(dtype)
+
+    def multiply(self, a, out=None):
+        "returns a times the product, written into out if it is given"
+        if self.full is not None:
+            return np.multiply(a, self.full, out=out)
+        out = np.multiply(a, self.factors[0], out=out)
+        for factor in self.factors[1:]:
+            out *= factor
+        return out
+
+
+class SchrodingerND(Schrodinger):
+    """
+    Class which implements a numerical solution of the time-dependent
+    Schrodinger equation on a two or three dimensional grid
+    """
+    def __init__(self, x, psi_x0, V_x, k0=None, hbar=1, m=1, t0=0.0,
+                 workers=None, memory_budget=None, dtype=complex,
+                 scheme='strang'):
+        """
+        Parameters
+        ----------
+        x : sequence of array_like, float
+            one array of evenly spaced coordinates per axis.  The axes may
+            have different lengths and spacings.
+        psi_x0 : array_like, complex
+            array of the initial wave function at time t0, of shape
+            (len(x[0]), len(x[1]), ...)
+        V_x : array_like, float
+            array giving the potential at each grid point, shaped like psi_x0
+        k0 : sequence of float, optional
+            the minimum value of k along each axis, as for ``Schrodinger``.
+            If not specified, each k range is centered on zero.
+        hbar : float
+            value of planck's constant (default = 1)
+        m : float
+            particle mass (default = 1)
+        t0 : float
+            initial time (default = 0)
+        workers : int, optional
+            number of threads for each fft, -1 for one per CPU
+        memory_budget : int, optional
+            bytes the precomputed step and phase factors may take.  If
+            the full arrays do not fit, the kinetic and phase factors are
+            applied axis by axis and no merged potential factor is kept
+            between steps, which costs a few more passes over psi per step.
+            If not specified, the full arrays are used.
+        dtype : numpy dtype, optional
+            complex type of the wave function and of every factor, as for
+            ``Schrodinger`` (default = complex128)
+        scheme : string
+            splitting scheme, as for ``Schrodinger`` (default = 'strang')
+        """
+        self.x = [np.asarray(axis, dtype=float) for axis in x]
+        psi_x0 = np.asarray(psi_x0)
+        self.V_x = np.asarray(V_x, dtype=float)
+        self.shape = tuple(axis.size for axis in self.x)
+        assert len(self.shape) in (2, 3)
+        assert psi_x0.shape == self.shape
+        assert self.V_x.shape == self.shape
+
+        # Set internal parameters
+        self.hbar = hbar
+        self.m = m
+        self.t = t0
+        self.dt_ = None
+        self.N = int(np.prod(self.shape))
+        self.dx = np.array([axis[1] - axis[0] for axis in self.x])
+        self.dk = 2 * np.pi / (np.array(self.shape) * self.dx)
+
+        # set momentum scale
+        if k0 is None:
+            self.k0 = -0.5 * np.array(self.shape) * self.dk
+        else:
+            self.k0 = np.asarray(k0, dtype=float)
+        self.k = [k0_axis + dk_axis * np.arange(size) for k0_axis, dk_axis, size
+                  in zip(self.k0, self.dk, self.shape)]
+
+        self.dtype = np.dtype(dtype)
+        assert self.dtype.kind == 'c'
+
+        # the full arrays are one potential factor per distinct stage
+        # coefficient and a merged one, one kinetic factor per distinct
+        # coefficient and four phase factors; separable, only the first
+        a, b = SCHEMES[scheme]
+        array_size = self.N * self.dtype.itemsize
+        self.separable = (memory_budget is not None
+                          and (len(set(a)) + len(set(b)) + 5) * array_size
+                          > memory_budget)
+        if self.separable and len(set(a)) * array_size > memory_budget:
+            raise ValueError("memory_budget of %d bytes cannot hold the "
+                             "%d potential factors of %d bytes"
+                             % (memory_budget, len(set(a)), array_size))
+        full = not self.separable
+
+        # phase factors relating psi_x, psi_k to psi_mod_x, psi_mod_k
+        x_phase = [np.exp(1j * k[0] * x) * np.sqrt(2 * np.pi) / dx
+                   for k, x, dx in zip(self.k, self.x, self.dx)]
+        k_phase = [np.exp(-1j * x[0] * dk * np.arange(size))
+                   for x, dk, size in zip(self.x, self.dk, self.shape)]
+        self._x_phase = _Separable(x_phase, full, self.dtype)
+        self._x_phase_inverse = _Separable([1.0 / phase for phase in x_phase],
+                                           full, self.dtype)
+        self._k_phase = _Separable(k_phase, full, self.dtype)
+        self._k_phase_inverse = _Separable([np.conj(phase)
+                                            for phase in k_phase],
+                                           full, self.dtype)
+        self._abs_scale = np.prod(np.sqrt(2 * np.pi) / self.dx)
+
+        self.workers = workers
+        self._psi_mod_x = np.zeros(self.shape, dtype=self.dtype)
+        self._psi_mod_k = np.zeros(self.shape, dtype=self.dtype)
+        self._k_current = False
+        self._norm_reference = None
+        # no absorbing layers on these grids
+        self.absorber = None
+        self._layers = []
+
+        self.psi_x = psi_x0
+        self.compute_k_from_x()
+
+        # variables which hold steps in evolution of the
+        self.x_evolve_half = None
+        self.x_evolve = None
+        self.k_evolve = None
+        self.scheme = scheme
+        self._set_scheme_factors(None)
+        # with a memory budget only the factors of the current step are kept
+        self._factor_cache = OrderedDict()
+        self._factor_cache_size = 1 if memory_budget is not None else FACTOR_CACHE_SIZE
+        self._adaptive_level = None
+
+        self.steps = 0
+        self.diagnostics = None
+
+    def _set_psi_x(self, psi_x):
+        self._x_phase_inverse.multiply(psi_x, out=self._psi_mod_x)
+        self._k_current = False
+        self._norm_reference = None
+
+    def _set_psi_k(self, psi_k):
+        self._k_phase_inverse.multiply(psi_k, out=self._psi_mod_k)
+        self._k_current = True
+        self._norm_reference = None
+
+    def get_psi_x(self, out=None):
+        "return psi(x), written into out if it is given"
+        return self._x_phase.multiply(self._psi_mod_x, out=out)
+
+    def get_psi_k(self, out=None):
+        "return psi(k), written into out if it is given"
+        return self._k_phase.multiply(self.psi_mod_k, out=out)
+
+    def abs_psi_x(self, out=None):
+        "return |psi(x)|, written into out if it is given"
+        out = np.abs(self._psi_mod_x, out=out)
+        out *= self._abs_scale
+        return out
+
+    psi_x = property(get_psi_x, _set_psi_x)
+    psi_k = property(get_psi_k, _set_psi_k)
+
+    def _k_factor(self, c):
+        return _Separable([np.exp(-0.5 * 1j * self.hbar / self.m * (k * k) * c)
+                           for k in self.k], not self.separable, self.dtype)
+
+    def _merged_x_factor(self, c):
+        # without it the last and first stage factors are applied in turn
+        if self.separable:
+            return None
+        return self._x_factor(c)
+
+    def _evolve_k(self, psi, factor):
+        factor.multiply(psi, out=psi)
+
+    def _transform(self, psi, inverse=False):
+        if scipy_fft is not None:
+            transform = scipy_fft.ifftn if inverse else scipy_fft.fftn
+            result = transform(psi, overwrite_x=True, workers=self.workers)
+        else:
+            transform = fftpack.ifftn if inverse else fftpack.fftn
+            result = transform(psi, overwrite_x=True)
+        if not np.may_share_memory(result, psi):
+            psi[...] = result
+
+    def norm(self):
+        "return the sum of |psi(x)|^2 over the grid times the cell volume"
+        density = self.abs_psi_x()
+        density *= density
+        return np.sum(density, dtype=float) * np.prod(self.dx)
+
+    def expectation_values(self):
+        """
+        Return the norm and the expectation values of position and
+        momentum along each axis of the current wave function.
+
+        Returns
+        -------
+        values : dict
+            'norm' is a float; 'x' and 'p' are arrays with one value per axis
+        """
+        density = self.abs_psi_x() ** 2
+        density_k = self.abs_psi_k() ** 2
+        norm = density.sum() * np.prod(self.dx)
+        norm_k = density_k.sum()
+        x = []
+        p = []
+        for axis in range(len(self.shape)):
+            others = tuple(other for other in range(len(self.shape))
+                           if other != axis)
+            x.append(np.dot(density.sum(axis=others), self.x[axis]))
+            p.append(np.dot(density_k.sum(axis=others), self.k[axis]))
+        return {'norm': norm,
+                'x': np.array(x) * np.prod(self.dx) / norm,
+                'p': self.hbar * np.array(p) / norm_k}
+
+    def find_eigenstates(self, n, *args, **kwargs):
+        """
+        Not available on a grid of several dimensions: the imaginary time
+        search of ``animate.Schrodinger.find_eigenstates`` works on 1D
+        wave functions only.
+        """
+        raise NotImplementedError("find_eigenstates needs a 1D grid; use "
+                                  "animate.Schrodinger")
+
+
+######################################################################
+# Two dimensional demonstrations
+
+def _packet(x, y, y0, k0, width):
+    "gaussian packet centered on (0, y0) moving along y with wave number k0"
+    return gauss_x(x, width, 0.0, 0.0)[:, None] * gauss_x(y, width, y0, k0)[None, :]
+
+
+def two_slit_simulation(N=1024, dx=0.1, slit_width=1.0, slit_separation=5.0,
+                        k0=3.0, hbar=1.0, m=1.0, workers=None,
+                        memory_budget=None, dtype=complex, scheme='strang'):
+    """
+    Set up a gaussian packet moving along y towards a wall at y = 0 with
+    two slits in it, on an N x N grid.
+
+    Returns the SchrodingerND object.
+    """
+    x = dx * (np.arange(N) - 0.5 * N)
+    y = x.copy()
+    V_x = np.zeros((N, N))
+    wall = np.abs(y) < 0.5
+    slits = ((np.abs(x - 0.5 * slit_separation) < 0.5 * slit_width)
+             | (np.abs(x + 0.5 * slit_separation) < 0.5 * slit_width))
+    V_x[np.ix_(~slits, wall)] = 1E6
+    psi_x0 = _packet(x, y, -0.25 * N * dx, k0, 0.1 * N * dx / 4)
+    return SchrodingerND((x, y), psi_x0, V_x, hbar=hbar, m=m,
+                         workers=workers, memory_budget=memory_budget,
+                         dtype=dtype, scheme=scheme)
+
+
+def barrier_simulation(N=1024, dx=0.1, V0=1.5, width=1.0, k0=1.5,
+                       hbar=1.0, m=1.0, workers=None, memory_budget=None,
+                       dtype=complex, scheme='strang'):
+    """
+    Set up a gaussian packet moving along y towards a square barrier of
+    height V0 across the whole grid, on an N x N grid.
+
+    Returns the SchrodingerND object.
+    """
+    x = dx * (np.arange(N) - 0.5 * N)
+    y = x.copy()
+    V_x = np.zeros((N, N))
+    V_x[:, (y >= 0) & (y < width)] = V0
+    psi_x0 = _packet(x, y, -0.25 * N * dx, k0, 0.1 * N * dx / 4)
+    return SchrodingerND((x, y), psi_x0, V_x, hbar=hbar, m=m,
+                         workers=workers, memory_budget=memory_budget,
+                         dtype=dtype, scheme=scheme)
+
+
+def show_animation(S, dt, N_steps, frames):
+    from matplotlib import pyplot as pl
+    from matplotlib import animation
+
+    fig = pl.figure()
+    ax = fig.add_subplot(111)
+    extent = (S.x[1][0], S.x[1][-1], S.x[0][0], S.x[0][-1])
+    density = S.abs_psi_x() ** 2
+    image = ax.imshow(density, extent=extent, origin='lower',
+                      vmax=density.max())
+    ax.contour(S.V_x, levels=[0.5 * S.V_x.max()], extent=extent, colors='w')
+    ax.set_xlabel('$y$')
+    ax.set_ylabel('$x$')
+    title = ax.set_title("")
+
+    def animate(i):
+        S.time_step(dt, N_steps)
+        S.abs_psi_x(out=density)
+        density **= 2
+        image.set_data(density)
+        title.set_text("t = %.2f" % S.t)
+        return (image, title)
+
+    anim = animation.FuncAnimation(fig, animate, frames=frames, interval=30,
+                                   blit=False)
+    pl.show()
+
+
+def main(argv=None):
+    parser = batch.argument_parser(
+        'Two dimensional scattering by the split-step method.')
+    parser.add_argument('--setup', default='two-slit',
+                        choices=['two-slit', 'barrier'])
+    parser.add_argument('--points', type=int, default=1024,
+                        help='grid points along each axis')
+    parser.add_argument('--dx', type=float, default=0.1)
+    parser.add_argument('--dt', type=float, default=0.01)
+    parser.add_argument('--steps-per-frame', type=int, default=5)
+    parser.add_argument('--t-max', type=float, default=20)
+    parser.add_argument('--fft-workers', type=int, default=-1,
+                        help='threads per fft, -1 for one per CPU')
+    parser.add_argument('--memory-budget', type=float,
+                        help='megabytes for the precomputed step factors')
+    parser.add_argument('--dtype', default='complex128',
+                        choices=['complex128', 'complex64'],
+                        help='precision of the wave function and the '
+                        'evolution factors')
+    parser.add_argument('--scheme', default='strang', choices=sorted(SCHEMES),
+                        help='splitting scheme of a step')
+    args = batch.parse_arguments(parser, argv)
+
+    setup = two_slit_simulation if args.setup == 'two-slit' else barrier_simulation
+    budget = None
+    if args.memory_budget is not None:
+        budget = int(args.memory_budget * 2 ** 20)
+    S = setup(args.points, args.dx, workers=args.fft_workers,
+              memory_budget=budget, dtype=args.dtype, scheme=args.scheme)
+    frames = int(args.t_max / float(args.steps_per_frame * args.dt))
+    if not args.headless:
+        show_animation(S, args.dt, args.steps_per_frame, frames)
+        return
+
+    start = time.time()
+    norm_drift = np.zeros(frames)
+    for i in range(frames):
+        S.time_step(args.dt, args.steps_per_frame)
+        norm_drift[i] = S.norm_drift()
+    elapsed = time.time() - start
+    print("%d steps of a %s grid in %.2f s, %.1f ms per step"
+          % (frames * args.steps_per_frame, 'x'.join(map(str, S.shape)),
+             elapsed, 1000 * elapsed / (frames * args.steps_per_frame)))
+    print("norm drift at t = %g: %.3g" % (S.t, norm_drift[-1]))
+    if args.output:
+        batch.save_results(args.output, args, norm_drift=norm_drift, x=S.x[0], y=S.x[1],
+                           density=S.abs_psi_x() ** 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Streaming of time dependent simulations to disk.
+
+``Recorder`` preallocates one memory-mapped ``.npy`` file per quantity in
+a directory, |psi(x)|, |psi(k)| and t, and writes every snapshot of a run
+straight into its slot, so a long run never holds its trajectory in
+memory and can go at the full speed of the solver with nothing drawn.
+``record`` drives ``Schrodinger.run`` into a recorder, and ``load``
+memory-maps a finished (or interrupted) recording for analysis or
+rendering.
+
+A recording is a directory holding
+
+    t.npy          times of the snapshots, NaN for frames never written
+    abs_psi_x.npy  |psi(x)| of every snapshot, shape (frames,) + psi shape
+    abs_psi_k.npy  |psi(k)| of every snapshot, shaped the same
+    x.npy, k.npy, V_x.npy
+                   the grid and the potential, written once.  For a grid of
+                   several dimensions, x_0.npy, k_0.npy, x_1.npy, ... instead
+                   of x.npy and k.npy.
+"""
+
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+NAMES = ('t', 'abs_psi_x', 'abs_psi_k')
+# frames written between flushes of the memory maps to disk
+FLUSH_EVERY = 64
+
+
+def _grids(S):
+    "returns the name and array of every grid file of the Schrodinger object S"
+    grids = {'V_x': S.V_x}
+    if isinstance(S.x, list):
+        for axis, (x, k) in enumerate(zip(S.x, S.k)):
+            grids['x_%d' % axis] = x
+            grids['k_%d' % axis] = k
+    else:
+        grids['x'] = S.x
+        grids['k'] = S.k
+    return grids
+
+
+class Recorder(object):
+    """
+    Fixed length recording of snapshots of a Schrodinger object
+
+    Parameters
+    ----------
+    directory : string
+        where the files are written; created if needed
+    S : Schrodinger
+        the object whose snapshots are recorded.  Its grid and potential
+        are written straight away.
+    frames : int
+        number of snapshots the files have room for
+    dtype : numpy dtype, optional
+        type of the stored |psi|.  If not specified, the real type of
+        S.dtype, so a complex64 run is stored as float32.
+    flush_every : int
+        frames written between flushes to disk (default = FLUSH_EVERY)
+    """
+    def __init__(self, directory, S, frames, dtype=None, flush_every=FLUSH_EVERY):
+        if dtype is None:
+            dtype = np.finfo(S.dtype).dtype
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.frames = frames
+        self.flush_every = flush_every
+        self.count = 0
+
+        for name, array in _grids(S).items():
+            np.save(os.path.join(directory, name + '.npy'), array)
+        shape = (frames,) + S.abs_psi_x().shape
+        self.t = open_memmap(os.path.join(directory, 't.npy'), mode='w+',
+                             dtype=float, shape=(frames,))
+        self.t[:] = np.nan
+        self.abs_psi_x = open_memmap(os.path.join(directory, 'abs_psi_x.npy'),
+                                     mode='w+', dtype=dtype, shape=shape)
+        self.abs_psi_k = open_memmap(os.path.join(directory, 'abs_psi_k.npy'),
+                                     mode='w+', dtype=dtype, shape=shape)
+
+    def write(self, S):
+        "stores the current snapshot of S in the next free frame"
+        if self.count >= self.frames:
+            raise ValueError("recording in %s is full (%d frames)"
+                             % (self.directory, self.frames))
+        S.abs_psi_x(out=self.abs_psi_x[self.count])
+        S.abs_psi_k(out=self.abs_psi_k[self.count])
+        self.t[self.count] = S.t
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        "writes the frames recorded so far to disk"
+        for array in (self.t, self.abs_psi_x, self.abs_psi_k):
+            array.flush()
+
+    def close(self):
+        "flushes and releases the memory maps"
+        self.flush()
+        self.t = self.abs_psi_x = self.abs_psi_k = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def record(S, directory, dt, n_steps, every=1, dtype=None, tolerance=None):
+    """
+    Advance S by n_steps steps of dt and record a snapshot every `every`
+    steps, and after the last step, into directory.  With a tolerance the
+    steps between snapshots are adaptive (see ``Schrodinger.run``).
+
+    Returns the number of frames written.
+    """
+    frames = -(-n_steps // every)
+    with Recorder(directory, S, frames, dtype) as recorder:
+        for snapshot in S.run(dt, n_steps, every, tolerance):
+            recorder.write(snapshot)
+        return recorder.count
+
+
+def load(directory):
+    """
+    Return a dict of the arrays of a recording, keyed by file name without
+    the .npy.  The snapshots are read-only memory maps; frames that were
+    never written (as after an interrupted run) are left out.
+    """
+    arrays = {}
+    for name in os.listdir(directory):
+        if name.endswith('.npy'):
+            arrays[name[:-4]] = np.load(os.path.join(directory, name),
+                                        mmap_mode='r')
+    frames = int(np.sum(np.isfinite(arrays['t'])))
+    for name in NAMES:
+        arrays[name] = arrays[name][:frames]
+    return arrays
@@ -3,11 +3,34 @@
 '''
 Usage:
     houghcircles.py [<image_name>]
+    houghcircles.py --batch <directory> --output <results.csv|results.json>
+                    [--workers N]
+
+With an image name every stage is shown in a window.  With --batch every
+image in the directory goes through the same stages on a process pool,
+without any window, and the circles found are written to a CSV file (one
+row per circle) or a JSON file (one entry per image).  The parameter of
+each image is read from its name: i=0-05.jpg is i = 0.05 and 2-15.jpg is
+2.15.  An image that can not be read or processed is reported with its
+error instead of circles, and the rest of the batch goes on.
 '''
 
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+
 import cv2
 import numpy as np
-import sys
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+# name=1-05.jpg or 1-05.jpg, the dash standing for the decimal point
+PARAMETER_PATTERN = re.compile(r'^(?:(\w+)=)?(\d+)-(\d+)$')
+CSV_FIELDS = ('file', 'parameter', 'value', 'x', 'y', 'radius', 'error')
+
 
 def waiter():
     k = cv2.waitKey(0)
@@ -16,47 +39,150 @@ def waiter():
     cv2.destroyAllWindows()
 
 
-if __name__ == '__main__':
-    print(__doc__)
+def stages(src):
+    "yields the name and image of every stage before circle detection"
+    img = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+    yield "original", img
+    img = cv2.fastNlMeansDenoising(img, None, 10, 10, 3)
+    yield "removing noise", img
+    img = cv2.equalizeHist(img)
+    yield "contrast streched", img
+    img = cv2.medianBlur(img, 5)
+    yield "after blur", img
+
+
+def find_circles(img):
+    "returns the (x, y, radius) rows of the circles in a prepared image"
+    circles = cv2.HoughCircles(img, cv2.HOUGH_GRADIENT, 1, 20, np.array([]),
+                               param1=1, param2=300, minRadius=100,
+                               maxRadius=0)
+    # older opencv returns None when nothing is found, newer an empty array
+    if circles is None or circles.size == 0:
+        return np.zeros((0, 3))
+    return circles.reshape(-1, 3)
+
+
+def parse_parameter(fn):
+    "returns the name (or None) and value of the parameter in a file name"
+    match = PARAMETER_PATTERN.match(os.path.splitext(os.path.basename(fn))[0])
+    if match is None:
+        return None, None
+    name, whole, fraction = match.groups()
+    return name, float(whole + '.' + fraction)
+
+
+def process_image(fn):
+    "runs every stage on one image and returns what was found as a dict"
+    src = cv2.imread(fn, 1)
+    if src is None:
+        raise ValueError("can not read image %s" % fn)
+    for name, img in stages(src):
+        pass
+    parameter, value = parse_parameter(fn)
+    return {'file': os.path.basename(fn), 'parameter': parameter,
+            'value': value, 'circles': find_circles(img).tolist(),
+            'error': None}
 
+
+def process_batch_image(fn):
+    "process_image for a batch: a failure is returned as the error of the result"
     try:
-        fn = sys.argv[1]
-    except IndexError:
-        sys.exit("Provide image in arg")
+        return process_image(fn)
+    except (ValueError, cv2.error) as error:
+        parameter, value = parse_parameter(fn)
+        return {'file': os.path.basename(fn), 'parameter': parameter,
+                'value': value, 'circles': [], 'error': str(error)}
+
+
+def process_directory(directory, workers=None):
+    """
+    Runs process_batch_image on every image in directory on a process pool
+    and returns the results sorted by parameter and value.
+    """
+    names = [os.path.join(directory, name)
+             for name in sorted(os.listdir(directory))
+             if name.lower().endswith(IMAGE_EXTENSIONS)]
+    # one opencv thread per process, the pool already uses every CPU
+    with ProcessPoolExecutor(workers, initializer=cv2.setNumThreads,
+                             initargs=(1,)) as executor:
+        results = list(executor.map(process_batch_image, names))
+    return sorted(results, key=lambda result: (result['parameter'] or '',
+                                               result['value'] is None,
+                                               result['value'], result['file']))
+
 
+def save_results(path, results):
+    "writes the results to a JSON file, or to a CSV file with one row per circle"
+    if path.endswith('.json'):
+        with open(path, 'w', newline='') as output:
+            json.dump(results, output, indent=1)
+        return
+    # the csv module writes its own line endings
+    with open(path, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(CSV_FIELDS)
+        for result in results:
+            row = [result['file'], result['parameter'] or '',
+                   '' if result['value'] is None else result['value']]
+            error = result['error'] or ''
+            if not result['circles']:
+                writer.writerow(row + ['', '', '', error])
+            for x, y, radius in result['circles']:
+                writer.writerow(row + [x, y, radius, error])
+
+
+def show(fn):
+    "runs every stage on one image, showing each in a window"
     print("Starting calc")
     src = cv2.imread(fn, 1)
-    
-    print("Converting to greyscale")
-    img = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    cv2.imshow("original", img)
-    waiter()
-   
-    print("Removing noise")
-    img = cv2.fastNlMeansDenoising(img, None, 10, 10, 3)
-    cv2.imshow("removing noise", img)
-    waiter()
+    if src is None:
+        sys.exit("Can not read image %s" % fn)
 
-    print("Contrast streching")
-    img = cv2.equalizeHist(img)
-    cv2.imshow("contrast streched", img)
-    waiter()
+    messages = ["Converting to greyscale", "Removing noise",
+                "Contrast streching", "Bluring"]
+    for message, (name, img) in zip(messages, stages(src)):
+        print(message)
+        cv2.imshow(name, img)
+        waiter()
 
-    print("Bluring")
-    img = cv2.medianBlur(img, 5)
-    cv2.imshow("after blur", img)
-    waiter()
-    
     print("Detecting circles")
     cimg = src.copy() # numpy function
-    circles = cv2.HoughCircles(img, cv2.HOUGH_GRADIENT, 1, 20, np.array([]), param1=1, param2=300, minRadius=100, maxRadius=0)
+    circles = find_circles(img)
 
-    if circles is not None: # Check if circles have been found and only then iterate over these and add them to the image
+    if len(circles): # Check if circles have been found and only then iterate over these and add them to the image
         print("Drawing images")
-        a, b, c = circles.shape
-        for i in range(2):
-            cv2.circle(cimg, (circles[0][i][0], circles[0][i][1]), circles[0][i][2], (0, 0, 255), 3, cv2.LINE_AA)
-            cv2.circle(cimg, (circles[0][i][0], circles[0][i][1]), 2, (0, 255, 0), 3, cv2.LINE_AA)  # draw center of circle
+        for x, y, radius in circles:
+            print("center (%g, %g), radius %g" % (x, y, radius))
+            center = (int(round(x)), int(round(y)))
+            cv2.circle(cimg, center, int(round(radius)), (0, 0, 255), 3, cv2.LINE_AA)
+            cv2.circle(cimg, center, 2, (0, 255, 0), 3, cv2.LINE_AA)  # draw center of circle
         cv2.imshow("detected circles", cimg)
         print("Press key to exit")
         cv2.waitKey(0)
+
+
+if __name__ == '__main__':
+    print(__doc__)
+
+    parser = argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument('image', nargs='?')
+    parser.add_argument('--batch', metavar='DIRECTORY')
+    parser.add_argument('--output', default='circles.csv')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    if args.batch:
+        results = process_directory(args.batch, args.workers)
+        save_results(args.output, results)
+        failed = [result for result in results if result['error']]
+        for result in failed:
+            print("skipped %s: %s" % (result['file'], result['error']),
+                  file=sys.stderr)
+        print("%d images (%d failed), %d circles written to %s"
+              % (len(results), len(failed), sum(len(result['circles'])
+                                                for result in results),
+                 args.output))
+    elif args.image:
+        show(args.image)
+    else:
+        sys.exit("Provide image in arg")